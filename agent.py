@@ -1,42 +1,112 @@
 # Python librairies
+import math
 import numpy as np
 import random
 import pickle
 
-from collections import defaultdict
+from collections import OrderedDict
+from functools import lru_cache
 
 # local files
-from environment import GridEnv
+from environment import GridEnv, MOVES, OBSERVE
+from qtable import QTable, encode, encode_limbs, encode_many
+
+
+REWARD_MAPPING = {
+    0: -20,  # WALL
+    1: -0.5,  # OTHER_AGENT
+    2: -2,  # DISCOVERED_EMPTY
+    3: 0,  # DISCOVERED_MINERAL
+    4: 2,  # JUST_DISCOVERED_EMPTY
+    5: 30,  # JUST_DISCOVERED_MINERAL
+}
+# REWARD_MAPPING as a lookup table indexed by cell value
+REWARDS = np.zeros(16)
+for cell, reward in REWARD_MAPPING.items():
+    REWARDS[cell] = reward
 
 
 class State:
     """
-    The state of an agent at a given time
+    The state of an agent at a given time, an immutable value: its key and
+    reward are computed once. Use StateCache.get to reuse the State of an
+    observation already seen.
     """
 
-    def __init__(self, grid):
-        self.grid = grid
+    __slots__ = ("grid", "key", "reward", "canonical_key")
+
+    def __init__(self, grid, key: int = None):
+        self.grid = np.asarray(grid, dtype=np.uint8)
+        self.key = encode(self.grid) if key is None else key
         self.reward = self.get_reward()
+        self.canonical_key = None
 
     def get_reward(self):
-        reward_mapping = {
-            0: -20,  # WALL
-            1: -0.5,  # OTHER_AGENT
-            2: -2,  # DISCOVERED_EMPTY
-            3: 0,  # DISCOVERED_MINERAL
-            4: 2,  # JUST_DISCOVERED_EMPTY
-            5: 30,  # JUST_DISCOVERED_MINERAL
-        }
-        return sum(reward_mapping.get(cell, 0) for cell in self.grid)
+        return float(REWARDS[self.grid].sum())
 
     def __eq__(self, other):
-        return np.array_equal(self.grid, other.grid)
+        return self.key == other.key
 
     def __hash__(self):
-        return hash(tuple(self.grid))
+        return hash(self.key)
 
     def get_key(self):
-        return tuple(self.grid)
+        return self.key
+
+    def get_canonical_key(self):
+        """
+        (code, symmetry) of the symmetric version of grid with the smallest
+        code, see canonicalize
+        """
+        if self.canonical_key is None:
+            codes, symmetries = canonicalize(np.reshape(self.grid, (1, -1)))
+            self.canonical_key = codes[0], symmetries[0]
+        return self.canonical_key
+
+
+class StateCache:
+    """
+    Interns States by key, so an observation seen again gets the same State
+    (and reward) back instead of a new one.
+    ...
+
+    Attributes
+    ----------
+    maxsize: int
+      States kept, the least recently used ones are dropped beyond that
+    hits: int
+      get calls answered from the cache
+    misses: int
+      get calls that built a new State
+    """
+
+    def __init__(self, maxsize: int = 2**16):
+        self.maxsize = maxsize
+        self.states = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.states)
+
+    def get(self, grid) -> State:
+        key = encode(grid)
+        state = self.states.get(key)
+        if state is not None:
+            self.states.move_to_end(key)
+            self.hits += 1
+            return state
+
+        self.misses += 1
+        state = self.states[key] = State(grid, key)
+        if len(self.states) > self.maxsize:
+            self.states.popitem(last=False)
+        return state
+
+    def clear(self):
+        self.states.clear()
+        self.hits = 0
+        self.misses = 0
 
 
 class Action:
@@ -50,6 +120,9 @@ class Action:
     RIGHT = 3
 
 
+ACTIONS = np.array([Action.UP, Action.DOWN, Action.LEFT, Action.RIGHT])
+
+
 class CellType:
     WALL = 0
     OTHER_AGENT = 1
@@ -60,6 +133,93 @@ class CellType:
     SELF = 6
 
 
+@lru_cache
+def off_axis(fov: int) -> np.ndarray:
+    """
+    Mask of the observation window without the row and column of its center
+    """
+    mask = np.ones((2 * fov + 1, 2 * fov + 1), dtype=bool)
+    mask[fov, :] = False
+    mask[:, fov] = False
+    return mask
+
+
+@lru_cache
+def window_offsets(fov: int, width: int) -> np.ndarray:
+    """
+    (2 * fov + 1)² offsets of the cells of an observation window from its
+    center, as flat indices in a padded array of that width
+    """
+    dx, dy = np.mgrid[-fov : fov + 1, -fov : fov + 1]
+    return dx * width + dy
+
+
+# The 8 symmetries of the square (4 rotations, 4 mirrors) as matrices acting
+# on (dx, dy), the identity first
+SYMMETRIES = np.array(
+    [
+        [[1, 0], [0, 1]],
+        [[0, -1], [1, 0]],
+        [[-1, 0], [0, -1]],
+        [[0, 1], [-1, 0]],
+        [[-1, 0], [0, 1]],
+        [[1, 0], [0, -1]],
+        [[0, 1], [1, 0]],
+        [[0, -1], [-1, 0]],
+    ]
+)
+# ACTION_MAP[s, a]: action a seen through symmetry s, UNMAP[s] is its inverse
+ACTION_MAP = np.argmax(
+    np.all(
+        np.einsum("sij,aj->sai", SYMMETRIES, MOVES)[:, :, None] == MOVES, axis=3
+    ),
+    axis=2,
+)
+UNMAP = np.argsort(ACTION_MAP, axis=1)
+
+
+@lru_cache
+def symmetry_permutations(cells: int) -> np.ndarray:
+    """
+    (8, cells) permutations of a flat observation window: observation[perms[s]]
+    is the window seen through SYMMETRIES[s]
+    """
+    fov = (math.isqrt(cells) - 1) // 2
+    side = 2 * fov + 1
+    offsets = np.mgrid[-fov : fov + 1, -fov : fov + 1].reshape(2, -1)
+    perms = np.empty((len(SYMMETRIES), cells), dtype=np.intp)
+    for s, matrix in enumerate(SYMMETRIES):
+        dx, dy = matrix @ offsets + fov
+        perms[s, dx * side + dy] = np.arange(cells)
+    return perms
+
+
+def canonicalize(states: np.ndarray):
+    """
+    Picks, for each observation, the symmetric version with the smallest
+    state code, so the 8 versions of a situation share one Q-table entry.
+
+    Parameters:
+    - states (np.ndarray): (n, cells) observations.
+
+    Returns:
+    - (list, np.ndarray): the n canonical state codes and the symmetry
+      (index in SYMMETRIES) giving each one, the first one on ties.
+    """
+    states = np.asarray(states)
+    variants = states[:, symmetry_permutations(states.shape[1])]
+    limbs = encode_limbs(variants)
+
+    # The last limb holds the highest digits, compare from there
+    smallest = np.ones(variants.shape[:2], dtype=bool)
+    for i in reversed(range(limbs.shape[2])):
+        limb = np.where(smallest, limbs[:, :, i], np.iinfo(np.int64).max)
+        smallest &= limb == limb.min(axis=1, keepdims=True)
+
+    chosen = np.argmax(smallest, axis=1)
+    return encode_many(variants[np.arange(len(states)), chosen]), chosen
+
+
 class Agent:
     """
     Class that represent agents that will work as a swarm.
@@ -67,8 +227,10 @@ class Agent:
 
     Attributes
     ----------
-    q_table: defaultdict(float)
+    q_table: QTable
       common q_table for the agent
+    states: StateCache
+      States of the observations, shared by the agents
 
     Methods
     -------
@@ -83,11 +245,16 @@ class Agent:
       learning_rate: float,
       discount_factor: float,
       exploration_rate: float,
+      symmetric: bool
+        observations are looked up in the Q-table under their canonical
+        rotation / mirror (see canonicalize) and the actions are remapped to
+        match. A table learned with symmetric agents only works with them.
     )
         Create an agent
     """
 
-    q_table = defaultdict(float)
+    q_table = QTable(num_actions=len(ACTIONS))
+    states = StateCache()
 
     def __init__(
         self,
@@ -95,59 +262,147 @@ class Agent:
         learning_rate: float = 0.90,
         discount_factor: float = 0.99,
         exploration_rate: float = 0.2,
+        symmetric: bool = False,
     ):
         self.fov = fov
         self.learning_rate = learning_rate
         self.discount_factor = discount_factor
         self.exploration_rate = exploration_rate
+        self.symmetric = symmetric
         self.state = State([0])  # CHARGER L'etat reel
 
     def choose_action(self, state, env) -> int:
-        actions = [
-            value for key, value in vars(Action).items() if not key.startswith("__")
-        ]
-
         if np.random.random() < self.exploration_rate:  # Exloration
-            return np.random.choice(actions)
-        else:  # Best action
-            state_key = state.get_key()
-            q_values = {a: self.__class__.q_table[(state_key, a)] for a in actions}
-            max_q = max(q_values.values()) if q_values else 0
-
-            # All actions with equal max value
-            best_actions = [a for a, q in q_values.items() if q == max_q]
-            return np.random.choice(best_actions) if best_actions else None
-
-    def update_q_table(self, state, action, reward, next_state):
-        state_key = state.get_key()
-        next_key = next_state.get_key() if next_state else None
-        current_q = self.__class__.q_table.get((state_key, action), 0)
-
-        actions = [
-            value for key, value in vars(Action).items() if not key.startswith("__")
-        ]
-
-        next_max = (
-            max([self.__class__.q_table.get((next_key, a), 0) for a in actions])
-            if next_key
-            else 0
+            return np.random.choice(ACTIONS)
+        elif self.symmetric:  # Best action of the canonical state, unmapped
+            code, symmetry = state.get_canonical_key()
+            return np.random.choice(UNMAP[symmetry, self.q_table.best_actions(code)])
+        else:  # Best action, ties are broken randomly
+            return np.random.choice(self.q_table.best_actions(state.get_key()))
+
+    def greedy_action(self, policy, state) -> int:
+        """
+        choose_action with a compiled qtable.Policy: no exploration and
+        nothing read from or written to the Q-table
+        """
+        if self.symmetric:
+            code, symmetry = state.get_canonical_key()
+            return UNMAP[symmetry, policy.action(code)]
+        return policy.action(state.get_key())
+
+    def update_q_table(self, state, action, reward, next_state, replay=None):
+        """
+        With a ReplayBuffer, the transition is added to it instead of being
+        learned right away
+        """
+        if self.symmetric:
+            code, symmetry = state.get_canonical_key()
+            action = ACTION_MAP[symmetry, action]
+            next_code = next_state.get_canonical_key()[0] if next_state else None
+        else:
+            code = state.get_key()
+            next_code = next_state.get_key() if next_state else None
+        if replay is not None and next_code is not None:
+            row, next_row = self.q_table.row(code), self.q_table.row(next_code)
+            replay.add([row], [action], [reward], [next_row])
+            return
+        self.q_table.learn(
+            code,
+            action,
+            reward,
+            next_code,
+            self.learning_rate,
+            self.discount_factor,
         )
 
-        new_q = current_q + self.learning_rate * (
-            reward + self.discount_factor * next_max - current_q
+    def encode_states(self, states: np.ndarray):
+        """
+        State codes of (n, cells) observations and the symmetry each one is
+        seen through, always the identity (0) when the agent is not symmetric
+        """
+        if self.symmetric:
+            return canonicalize(states)
+        return encode_many(states), np.zeros(len(states), dtype=np.intp)
+
+    def choose_actions(self, codes: list, symmetries=None) -> np.ndarray:
+        """
+        choose_action for the states of a whole swarm at once, symmetries
+        come with the codes from encode_states
+        """
+        rows = self.q_table.rows(codes)
+        actions = self.q_table.greedy(rows)
+        if symmetries is not None:
+            actions = UNMAP[symmetries, actions]
+        explore = np.random.random(len(rows)) < self.exploration_rate
+        actions[explore] = np.random.randint(0, len(ACTIONS), explore.sum())
+        return actions
+
+    def greedy_actions(self, policy, codes: list, symmetries=None) -> np.ndarray:
+        """
+        greedy_action for the states of a whole swarm at once
+        """
+        actions = policy.actions(codes)
+        if symmetries is not None:
+            actions = UNMAP[symmetries, actions]
+        return actions
+
+    def update_q_tables(
+        self, codes, actions, rewards, next_codes, symmetries=None, replay=None
+    ):
+        """
+        update_q_table for the transitions of a whole swarm at once
+        """
+        if symmetries is not None:
+            actions = ACTION_MAP[symmetries, actions]
+        rows = self.q_table.rows(codes)
+        next_rows = self.q_table.rows(next_codes)
+        if replay is not None:
+            replay.add(rows, actions, rewards, next_rows)
+            return
+        self.q_table.learn_many(
+            rows,
+            actions,
+            rewards,
+            next_rows,
+            self.learning_rate,
+            self.discount_factor,
         )
 
-        self.__class__.q_table[(state_key, action)] = new_q
+    def replay(self, buffer):
+        """
+        Learns the minibatches of a ReplayBuffer
+        """
+        buffer.learn(self.q_table, self.learning_rate, self.discount_factor)
+
+    def trim_q_table(self, replay=None):
+        """
+        QTable.trim, between two steps: nothing holds rows of the table then
+        but the ReplayBuffer, its rows are renumbered
+        """
+        remap = self.q_table.trim()
+        if remap is not None and replay is not None:
+            replay.remap(remap)
 
     def save_q_table(self, filename):
-        with open(filename, "wb") as f:
-            pickle.dump(dict(self.q_table), f)
+        """
+        .pkl files are pickled, anything else is a checkpoint (see
+        QTable.checkpoint) that only gets the rows changed since it was loaded
+        """
+        if str(filename).endswith(".pkl"):
+            with open(filename, "wb") as f:
+                pickle.dump(self.q_table, f)
+        else:
+            self.q_table.checkpoint(filename)
 
-    def load_q_table(self, filename):
-        with open(filename, "rb") as f:
-            self.q_table.update(pickle.load(f))
+    def load_q_table(self, filename, replay=None):
+        """
+        QTable.load, the rows of replay are renumbered if the load dropped
+        rows of the table
+        """
+        remap = self.q_table.load(filename)
+        if remap is not None and replay is not None:
+            replay.remap(remap)
 
-    # Shamefully unreadable code
     def get_state(self, env: GridEnv, pos: (int, int)):
         """
         0: wall
@@ -156,42 +411,71 @@ class Agent:
         3: discovered_mineral
         4: just_discovered_empty
         5: just_discovered_mineral
+
+        Looking at a cell discovers it: hidden cells become just discovered
+        and just discovered cells become discovered in env.status.
         """
+        env.generate_around(pos, self.fov)
+        status = env.window(env.status, pos, self.fov)
+        seen = OBSERVE[status]
+
+        # Other agents are only reported off the row and column of pos and
+        # hide the cell they stand on
+        others = (env.window(env.occupancy, pos, self.fov) > 0) & off_axis(self.fov)
         x, y = pos
+        width = env.status.shape[-1]
+        cells = window_offsets(self.fov, width) + (x + env.fov) * width + y + env.fov
+        env.count_discoveries(status[~others], cells[~others])
+        status[~others] = seen[~others]
+        seen[others] = CellType.OTHER_AGENT
+
+        return self.states.get(seen.ravel())
+
+    def get_states(self, env: GridEnv, positions: np.ndarray) -> np.ndarray:
+        """
+        get_state for (n, 2) positions at once, one observation per row.
+        Cells seen by several agents are discovered in the order of
+        positions, exactly as calling get_state one position after the other.
+        """
+        env.generate_around(positions, self.fov)
+        width = env.status.shape[-1]
+        centers = (positions[:, 0] + env.fov) * width + positions[:, 1] + env.fov
+        return self.observe(env, centers)
+
+    def observe(self, env, centers: np.ndarray) -> np.ndarray:
+        """
+        get_states for the flat indices of the window centers in
+        env.status. The status (and occupancy) may stack several padded
+        worlds, see VecGridEnv.
+        """
         fov = self.fov
-        state_grid = []
-        for dx in range(-fov, fov + 1):
-            for dy in range(-fov, fov + 1):
-                new_x = x + dx
-                new_y = y + dy
-
-                if env.out_of_bound((new_x, new_y)):  # out_of_bound
-                    state_grid.append(CellType.WALL)
-
-                elif env.occupied((new_x, new_y)) and (
-                    new_x != x and new_y != y
-                ):  # occupied by another agent
-                    state_grid.append(CellType.OTHER_AGENT)
-                elif (new_x, new_y) in env.just_discovered_empty:
-                    del env.just_discovered_empty[(new_x, new_y)]
-                    env.discovered_empty[(new_x, new_y)] = 1
-                    state_grid.append(CellType.DISCOVERED_EMPTY)
-                elif (
-                    new_x,
-                    new_y,
-                ) in env.just_discovered_vein:  # next pos is part of vein
-                    del env.just_discovered_vein[(new_x, new_y)]
-                    env.discovered_vein[(new_x, new_y)] = 1
-                    state_grid.append(CellType.DISCOVERED_MINERAL)
-                elif (new_x, new_y) in env.discovered_empty:  # next post  is empty
-                    state_grid.append(CellType.DISCOVERED_EMPTY)
-                elif (new_x, new_y) in env.discovered_vein:
-                    state_grid.append(CellType.DISCOVERED_MINERAL)
-                elif env.world[new_x][new_y] == 1:
-                    env.just_discovered_vein[(new_x, new_y)] = 1
-                    state_grid.append(CellType.JUST_DISCOVERED_MINERAL)
-                else:
-                    env.just_discovered_empty[(new_x, new_y)] = 1
-                    state_grid.append(CellType.JUST_DISCOVERED_EMPTY)
-
-        return State(np.array(state_grid))
+        width = env.status.shape[-1]
+        window = window_offsets(fov, width).ravel()
+        cells = (centers[:, None] + window).ravel()
+
+        status = env.status.reshape(-1)
+        others = (env.occupancy.reshape(-1)[cells] > 0) & np.tile(
+            off_axis(fov).ravel(), len(centers)
+        )
+        looking = cells[~others]
+
+        # Rank of every look at a cell among the looks at the same cell: the
+        # first one discovers it, the following ones see it as discovered
+        order = np.argsort(looking, kind="stable")
+        ordered = looking[order]
+        first = np.r_[True, ordered[1:] != ordered[:-1]]
+        last = np.r_[ordered[1:] != ordered[:-1], True]
+
+        looked = status[ordered]
+        env.count_discoveries(looked[first], ordered[first])
+        seen_first = OBSERVE[looked]
+        seen = np.where(first, seen_first, OBSERVE[seen_first])
+        status[ordered[last]] = seen[last]
+
+        states = np.full(len(cells), CellType.OTHER_AGENT, dtype=np.uint8)
+        states[np.flatnonzero(~others)[order]] = seen
+        return states.reshape(len(centers), -1)
+
+    @staticmethod
+    def get_rewards(states: np.ndarray) -> np.ndarray:
+        return REWARDS[states].sum(axis=1)
@@ -0,0 +1,311 @@
+import argparse
+import itertools
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from agent import Agent, StateCache
+from environment import GridEnv
+from qtable import QTable
+from vecenv import VecGridEnv
+from video import (
+    array_to_image,
+    draw_environment,
+    frame_to_image,
+    generate_blobs,
+    grid_to_rgb,
+)
+
+
+# Timing settings of measure, see the command line
+REPEAT = 7
+WARMUP = 1
+MIN_TIME = 0.2
+
+
+def measure(run, setup=None, repeat=None, warmup=None, min_time=None):
+    """
+    Times run() and measures its peak memory in a second run, tracemalloc
+    slows the code down too much to do both at once.
+
+    A sample calls run() again (after a new setup, which is not timed) until
+    it has run for min_time seconds, so short runs are not timed on their
+    own. The first warmup samples are dropped.
+
+    Parameters:
+    - run (callable): The code to measure, returns how many operations it did.
+    - setup (callable): Called before each run, its return value is given to run.
+    - repeat (int): Samples kept, REPEAT by default.
+    - warmup (int): Samples dropped first, WARMUP by default.
+    - min_time (float): Seconds of every sample, MIN_TIME by default.
+
+    Returns:
+    - dict: per_second (median of the samples, operations per second), rsd
+      (relative standard deviation of the samples) and peak_memory (bytes).
+    """
+    repeat = REPEAT if repeat is None else repeat
+    warmup = WARMUP if warmup is None else warmup
+    min_time = MIN_TIME if min_time is None else min_time
+    rates = []
+    for sample in range(warmup + repeat):
+        elapsed, operations = 0.0, 0
+        while elapsed < min_time:
+            args = setup() if setup else None
+            start = time.perf_counter()
+            operations += run(args) if setup else run()
+            elapsed += time.perf_counter() - start
+        if sample >= warmup:
+            rates.append(operations / elapsed)
+    median = float(np.median(rates))
+
+    args = setup() if setup else None
+    tracemalloc.start()
+    run(args) if setup else run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "per_second": median,
+        "rsd": float(np.std(rates) / median),
+        "peak_memory": peak,
+    }
+
+
+def new_env(grid_size, num_agent, fov, batched=False):
+    # Every benchmark starts from an empty table and State cache
+    Agent.q_table = QTable()
+    Agent.states = StateCache()
+    np.random.seed(0)
+    return GridEnv(
+        grid_size=grid_size, num_agent=num_agent, fov=fov, batched=batched, seed=0
+    )
+
+
+def bench_step(grid_size, num_agent, fov, steps, batched=False):
+    def run(env):
+        for _ in range(steps):
+            env.step()
+        return steps
+
+    return measure(run, lambda: new_env(grid_size, num_agent, fov, batched))
+
+
+def bench_vec_step(grid_size, num_agent, fov, steps, num_envs=8):
+    """
+    VecGridEnv.step, in steps of a single world per second
+    """
+
+    def setup():
+        Agent.q_table = QTable()
+        Agent.states = StateCache()
+        np.random.seed(0)
+        return VecGridEnv(
+            num_envs, grid_size=grid_size, num_agent=num_agent, fov=fov, seed=0
+        )
+
+    def run(vec):
+        for _ in range(steps):
+            vec.step()
+        return steps * num_envs
+
+    return measure(run, setup)
+
+
+def bench_get_state(grid_size, num_agent, fov, steps):
+    def run(env):
+        agent = env.template_agent
+        for _ in range(steps):
+            for position in env.positions.tolist():
+                agent.get_state(env, position)
+        return steps * len(env.positions)
+
+    return measure(run, lambda: new_env(grid_size, num_agent, fov))
+
+
+def bench_learning(grid_size, num_agent, fov, steps):
+    """
+    choose_action + update_q_table on the states of a recorded episode
+    """
+
+    def setup():
+        env = new_env(grid_size, num_agent, fov)
+        states = []
+        for _ in range(steps):
+            env.step()
+            states.extend(agent.state for agent in env.agent_list)
+        return env.template_agent, states
+
+    def run(args):
+        agent, states = args
+        for state, next_state in zip(states, states[1:]):
+            action = agent.choose_action(state, None)
+            agent.update_q_table(state, action, next_state.reward, next_state)
+        return len(states) - 1
+
+    return measure(run, setup)
+
+
+def bench_generate(grid_size):
+    def run():
+        generate_blobs(grid_size, grid_size, 0.1, 10, seed=0)
+        return 1
+
+    return measure(run)
+
+
+def bench_render(grid_size, num_agent, fov, steps, chain=True):
+    """
+    chain: draw_environment -> grid_to_rgb -> array_to_image, else frame_to_image
+    """
+
+    def setup():
+        env = new_env(grid_size, num_agent, fov)
+        for _ in range(steps):
+            env.step()
+        return env
+
+    def run(env):
+        for frame in env.memory:
+            if chain:
+                array_to_image(grid_to_rgb(draw_environment(env.world, frame)))
+            else:
+                frame_to_image(frame)
+        return len(env.memory)
+
+    return measure(run, setup)
+
+
+def run_benchmarks(grid_sizes, num_agents, fovs, steps):
+    """
+    Returns:
+    - list: one record per benchmark and parameters, {name, params,
+      per_second, peak_memory}
+    """
+    results = []
+
+    def record(name, params, measured):
+        results.append({"name": name, "params": params, **measured})
+        print(
+            f"{key(results[-1]):<60} {measured['per_second']:>12.1f}/s "
+            f"±{100 * measured['rsd']:>5.1f}% "
+            f"{measured['peak_memory'] / 2**20:>9.2f} MiB",
+            file=sys.stderr,
+        )
+
+    for grid_size, num_agent, fov in itertools.product(grid_sizes, num_agents, fovs):
+        params = {"grid_size": grid_size, "num_agent": num_agent, "fov": fov}
+        record("step", params, bench_step(grid_size, num_agent, fov, steps))
+        record(
+            "step_batched",
+            params,
+            bench_step(grid_size, num_agent, fov, steps, batched=True),
+        )
+        record(
+            "vec_step",
+            {**params, "num_envs": 8},
+            bench_vec_step(grid_size, num_agent, fov, steps),
+        )
+        record("get_state", params, bench_get_state(grid_size, num_agent, fov, steps))
+        record("learning", params, bench_learning(grid_size, num_agent, fov, steps))
+
+    for grid_size in grid_sizes:
+        params = {"grid_size": grid_size}
+        record("generate_blobs", params, bench_generate(grid_size))
+        params = {"grid_size": grid_size, "num_agent": num_agents[0], "fov": fovs[0]}
+        render_steps = min(steps, 50)
+        record(
+            "render_chain",
+            params,
+            bench_render(grid_size, num_agents[0], fovs[0], render_steps),
+        )
+        record(
+            "frame_to_image",
+            params,
+            bench_render(grid_size, num_agents[0], fovs[0], render_steps, chain=False),
+        )
+
+    return results
+
+
+def key(result) -> str:
+    params = ",".join(f"{k}={v}" for k, v in sorted(result["params"].items()))
+    return f"{result['name']}[{params}]"
+
+
+def compare(results, baseline, tolerance=0.1, sigmas=3.0):
+    """
+    Results slower than the baseline by more than tolerance plus sigmas
+    times the noise of both timings (their rsd, 0 for baselines without
+    one), or using more than tolerance more memory, as (key, metric,
+    baseline, current) tuples
+    """
+    previous = {key(r): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        before = previous.get(key(result))
+        if before is None:
+            continue
+        noise = np.hypot(before.get("rsd", 0.0), result.get("rsd", 0.0))
+        # a very noisy timing still catches a several times slower path
+        allowed = min(tolerance + sigmas * noise, 0.5)
+        if result["per_second"] < before["per_second"] * (1 - allowed):
+            regressions.append(
+                (key(result), "per_second", before["per_second"], result["per_second"])
+            )
+        if result["peak_memory"] > before["peak_memory"] * (1 + tolerance):
+            regressions.append(
+                (
+                    key(result),
+                    "peak_memory",
+                    before["peak_memory"],
+                    result["peak_memory"],
+                )
+            )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the simulation, learning and rendering paths"
+    )
+    parser.add_argument("--grid-sizes", type=int, nargs="+", default=[50, 160])
+    parser.add_argument("--num-agents", type=int, nargs="+", default=[10, 100])
+    parser.add_argument("--fovs", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--steps", type=int, default=100)
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--baseline", help="previous --output to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    parser.add_argument(
+        "--sigmas", type=float, default=3.0, help="noise allowed on top of tolerance"
+    )
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--warmup", type=int, default=WARMUP)
+    parser.add_argument("--min-time", type=float, default=MIN_TIME)
+    args = parser.parse_args()
+    REPEAT, WARMUP, MIN_TIME = args.repeat, args.warmup, args.min_time
+
+    results = run_benchmarks(args.grid_sizes, args.num_agents, args.fovs, args.steps)
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "machine": platform.machine(),
+                "steps": args.steps,
+                "repeat": args.repeat,
+                "min_time": args.min_time,
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance, args.sigmas)
+        for name, metric, before, after in regressions:
+            print(f"REGRESSION {name} {metric}: {before:.1f} -> {after:.1f}")
+        sys.exit(1 if regressions else 0)
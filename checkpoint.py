@@ -0,0 +1,172 @@
+import os
+
+import numpy as np
+
+from typing import NamedTuple
+
+# File layout, all little endian:
+#   header  16 bytes: magic, version, num_actions
+#   chunks  one after the other, each one is
+#     chunk header  16 bytes: rows, code_bytes
+#     keys          rows state codes, code_bytes big endian bytes each, sorted
+#                   and padded to a multiple of 8 bytes
+#     values        (rows, num_actions) float32
+#     visits        (rows, num_actions) uint32
+# A code present in several chunks takes the values of the last one, so a
+# checkpoint only appends the rows that changed since the previous one.
+MAGIC = b"QTBL"
+VERSION = 1
+HEADER = np.dtype(
+    [("magic", "S4"), ("version", "<u2"), ("num_actions", "<u2"), ("reserved", "<u8")]
+)
+CHUNK_HEADER = np.dtype([("rows", "<u8"), ("code_bytes", "<u4"), ("reserved", "<u4")])
+
+
+class Chunk(NamedTuple):
+    """
+    One chunk of a checkpoint, the arrays are views on the file when it is
+    memory mapped
+    """
+
+    keys: np.ndarray  # (rows,) S<code_bytes>, sorted
+    values: np.ndarray  # (rows, num_actions) float32
+    visits: np.ndarray  # (rows, num_actions) uint32
+
+
+def _padded(size: int) -> int:
+    return -(-size // 8) * 8
+
+
+def code_bytes(codes: list) -> int:
+    return max(1, -(-max((code.bit_length() for code in codes), default=0) // 8))
+
+
+def pack_codes(codes: list, width: int) -> np.ndarray:
+    """
+    State codes as width bytes big endian keys, whose byte order is the
+    numeric order
+    """
+    limbs = -(-width // 8)
+    codes = np.array(codes, dtype=object).reshape(-1)
+    words = np.stack(
+        [(codes >> (64 * (limbs - 1 - i))) & 0xFFFFFFFFFFFFFFFF for i in range(limbs)],
+        axis=1,
+    ).astype(">u8")
+    raw = words.view(np.uint8).reshape(len(codes), 8 * limbs)[:, 8 * limbs - width :]
+    return np.ascontiguousarray(raw).view(f"S{width}").reshape(-1)
+
+
+def unpack_codes(keys: np.ndarray) -> list:
+    width = keys.dtype.itemsize
+    limbs = -(-width // 8)
+    raw = np.zeros((len(keys), 8 * limbs), dtype=np.uint8)
+    raw[:, 8 * limbs - width :] = keys.view(np.uint8).reshape(len(keys), width)
+    words = raw.view(">u8").astype(object)
+    codes = words[:, 0]
+    for i in range(1, limbs):
+        codes = (codes << 64) | words[:, i]
+    return codes.tolist()
+
+
+def find(chunks: list, code: int):
+    """
+    (values, visits) of code in the last chunk holding it, None if absent
+    """
+    for chunk in reversed(chunks):
+        width = chunk.keys.dtype.itemsize
+        if code.bit_length() > 8 * width:
+            continue
+        key = np.array([code.to_bytes(width, "big")], dtype=f"S{width}")
+        i = np.searchsorted(chunk.keys, key)[0]
+        if i < len(chunk.keys) and chunk.keys[i : i + 1] == key:
+            return chunk.values[i], chunk.visits[i]
+    return None
+
+
+def is_checkpoint(path) -> bool:
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except FileNotFoundError:
+        return False
+
+
+def _write_chunk(f, codes: list, values: np.ndarray, visits: np.ndarray):
+    width = code_bytes(codes)
+    keys = pack_codes(codes, width)
+    order = np.argsort(keys, kind="stable")
+
+    header = np.zeros(1, dtype=CHUNK_HEADER)
+    header["rows"] = len(codes)
+    header["code_bytes"] = width
+    f.write(header.tobytes())
+    f.write(keys[order].tobytes())
+    f.write(bytes(_padded(len(codes) * width) - len(codes) * width))
+    f.write(np.ascontiguousarray(values[order], dtype="<f4").tobytes())
+    f.write(np.ascontiguousarray(visits[order], dtype="<u4").tobytes())
+
+
+def create(path, num_actions: int, codes: list, values, visits):
+    """
+    Writes a checkpoint holding a single chunk. The file is written next to
+    path and renamed, so a reader (or a memory map) of the previous file is
+    never left with a half written one.
+    """
+    header = np.zeros(1, dtype=HEADER)
+    header["magic"] = MAGIC
+    header["version"] = VERSION
+    header["num_actions"] = num_actions
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(header.tobytes())
+        _write_chunk(f, codes, values, visits)
+    os.replace(tmp, path)
+
+
+def append(path, codes: list, values, visits):
+    with open(path, "ab") as f:
+        _write_chunk(f, codes, values, visits)
+
+
+def read(path, mmap: bool = True):
+    """
+    Returns:
+    - (num_actions, chunks). With mmap the chunks are read only views on the
+      file and nothing is loaded before it is looked up. A chunk cut short
+      by an interrupted append is ignored.
+    """
+    if mmap and os.path.getsize(path) > 0:
+        data = np.memmap(path, dtype=np.uint8, mode="r")
+    else:
+        data = np.fromfile(path, dtype=np.uint8)
+
+    header = data[: HEADER.itemsize].view(HEADER)[0]
+    if header["magic"] != MAGIC:
+        raise ValueError(f"{path} is not a Q-table checkpoint")
+    if header["version"] != VERSION:
+        raise ValueError(f"{path}: unsupported checkpoint version {header['version']}")
+    num_actions = int(header["num_actions"])
+
+    chunks = []
+    offset = HEADER.itemsize
+    while offset + CHUNK_HEADER.itemsize <= len(data):
+        chunk = data[offset : offset + CHUNK_HEADER.itemsize].view(CHUNK_HEADER)[0]
+        rows, width = int(chunk["rows"]), int(chunk["code_bytes"])
+        keys_start = offset + CHUNK_HEADER.itemsize
+        values_start = keys_start + _padded(rows * width)
+        visits_start = values_start + rows * num_actions * 4
+        end = visits_start + rows * num_actions * 4
+        if end > len(data):
+            break
+
+        chunks.append(
+            Chunk(
+                data[keys_start : keys_start + rows * width].view(f"S{width}"),
+                data[values_start:visits_start].view("<f4").reshape(rows, num_actions),
+                data[visits_start:end].view("<u4").reshape(rows, num_actions),
+            )
+        )
+        offset = end
+
+    return num_actions, chunks
@@ -1,11 +1,40 @@
 import numpy as np
 
 import random
+import time
 
+from snapshots import Frame, SnapshotLog
 
 # from .agent import Agent
 
 
+class CellStatus:
+    """
+    Values stored in GridEnv.status. The discovered values are the same as
+    the CellType an agent observes, hidden cells still remember the world.
+    """
+
+    WALL = 0
+    DISCOVERED_EMPTY = 2
+    DISCOVERED_MINERAL = 3
+    JUST_DISCOVERED_EMPTY = 4
+    JUST_DISCOVERED_MINERAL = 5
+    HIDDEN_EMPTY = 8
+    HIDDEN_MINERAL = 9
+
+
+# Moves of the actions UP, DOWN, LEFT and RIGHT
+MOVES = np.array([(0, -1), (0, 1), (-1, 0), (1, 0)])
+
+# What a cell looks like (and becomes) once an agent looks at it:
+# hidden -> just discovered -> discovered
+OBSERVE = np.arange(16, dtype=np.uint8)
+OBSERVE[CellStatus.JUST_DISCOVERED_EMPTY] = CellStatus.DISCOVERED_EMPTY
+OBSERVE[CellStatus.JUST_DISCOVERED_MINERAL] = CellStatus.DISCOVERED_MINERAL
+OBSERVE[CellStatus.HIDDEN_EMPTY] = CellStatus.JUST_DISCOVERED_EMPTY
+OBSERVE[CellStatus.HIDDEN_MINERAL] = CellStatus.JUST_DISCOVERED_MINERAL
+
+
 class GridEnv:
     def __init__(
         self,
@@ -16,6 +45,12 @@ class GridEnv:
         learning_rate=0.9,
         discount_factor=0.99,
         exploration_rate=0.2,
+        batched=False,
+        seed=None,
+        symmetric=False,
+        tile_size=None,
+        world_path=None,
+        frontier=None,
     ):
         """
         A class used to represent the world
@@ -26,10 +61,32 @@ class GridEnv:
         ----------
         grid_size : int
             represents the width and heigth of the grid. Example: 50 -> 50x50
+        fov : int
+            field of view of the agents, also the width of the wall padding
+            around status
         num_agent : int
             the name of the animal
         agent_start_pos: (int, int)
             starting position of the agents
+        batched : bool
+            step all the agents at once with array operations instead of one
+            after the other, see step_batched
+        seed : int
+            seed of the generated world, a random world when None
+        symmetric : bool
+            agents share the Q-table entries of rotated and mirrored
+            observations, see agent.canonicalize
+        tile_size : int
+            generate the world tile_size² cells at a time, when agents first
+            look at them (see tiles.TiledWorld) instead of all at once.
+            world is None then, the world only lives in status.
+        world_path : str
+            file status is memory mapped on (and occupancy on
+            world_path.occupancy), in memory when None
+        frontier : int
+            block size of a frontier.FrontierField: agents whose last
+            observation showed nothing new head for the nearest unexplored
+            cells instead of following the Q-table
 
         Methods
         -------
@@ -37,55 +94,194 @@ class GridEnv:
             Description
         """
         self.grid_size = grid_size
+        self.fov = fov
         # Array of size : grid-size
         # if (x,y) = 1 -> mineral
         # else -> empty
-        self.world = np.array([[0] * grid_size] * grid_size)
+        self.world = None
         # self.world = [[0] * grid_size] * grid_size
         # we need a representation that differentiates between recently discovered minerals
         # and minerals that were discovered previously
         # self.recently_discovered = []
-        self.discovered_empty = {}
-        self.just_discovered_empty = {}
-        self.discovered_vein = {}
-        self.just_discovered_vein = {}
-        self.agents = {}  # {(k: pos, v: agent)}
-        self.memory = []
+        # status keeps one CellStatus per cell, padded by fov on every side so
+        # the walls are part of the array: cell (x, y) is status[x + fov, y + fov]
+        self.status = None
+        # id + 1 of the agent standing on every cell, 0 when it is free,
+        # padded like status. Unsigned, with the smallest dtype holding the
+        # ids.
+        self.occupancy = None
+        # the agents, their index in this list is their id
+        self.agent_list = []
+        # position of every agent, row i is the position of agent_list[i]
+        self.positions = np.zeros((0, 2), dtype=np.int64)
+        self.batched = batched
+        # one frame per step, see SnapshotLog
+        self.memory = SnapshotLog()
+        # optional VideoRecorder given to train or simulate, it gets every
+        # snapshot as it is taken
+        self.recorder = None
+        # optional instrumentation.Metrics timing the phases of step
+        self.metrics = None
+        # optional replay.ReplayBuffer, the transitions go through it instead
+        # of being learned right away
+        self.replay = None
+        # optional qtable.Policy of a frozen simulate, the agents follow it
+        # and the Q-table is left alone
+        self.policy = None
+        # steps done so far
+        self.steps = 0
+        # steps given to the recorder, with the values of snapshot_every, the
+        # same steps as memory when None
+        self.record_every = None
+        # snapshot every snapshot_every steps, never when 0 and only once at
+        # the end of train / simulate when "final"
+        self.snapshot_every = 1
         # Delay import to avoid circular dependency
         from agent import Agent
         from video import generate_blobs
+        import tiles
+        from frontier import FrontierField
+        from tiles import TiledWorld
 
         # workaround to load an agent to save file later on
         # thank you python for being such an excellent language 🖕
-        self.template_agent = Agent()
+        self.template_agent = Agent(
+            fov=fov,
+            learning_rate=learning_rate,
+            discount_factor=discount_factor,
+            exploration_rate=exploration_rate,
+            symmetric=symmetric,
+        )
 
         # Initialize agents
-        i = 0
-        while i < num_agent:
+        positions = {}  # dict as an ordered set
+        while len(positions) < num_agent:
 
             x, y = np.random.randint(0, grid_size, 2)
-            if not ((x, y) in self.agents):
-                self.agents[(x, y)] = Agent(
-                    fov=fov,
-                    learning_rate=learning_rate,
-                    discount_factor=discount_factor,
-                    exploration_rate=exploration_rate,
+            if not ((x, y) in positions):
+                positions[(x, y)] = None
+                self.agent_list.append(
+                    Agent(
+                        fov=fov,
+                        learning_rate=learning_rate,
+                        discount_factor=discount_factor,
+                        exploration_rate=exploration_rate,
+                        symmetric=symmetric,
+                    )
                 )
-                i += 1
-                continue
+        self.positions = np.array(list(positions), dtype=np.int64).reshape(-1, 2)
+
+        size = grid_size + 2 * fov
+        self.tiles = None
+        if tile_size:
+            self.tiles = TiledWorld(
+                grid_size, fov, tile_size, seed=seed, path=world_path
+            )
+            self.status = self.tiles.status
+        else:
+            # Initialize veins
+            self.world = generate_blobs(
+                self.grid_size, self.grid_size, 0.1, 10, seed=seed
+            )
+            for i in range(grid_size - 1, grid_size - 4, -1):
+                for j in range(grid_size - 1, grid_size - 4, -1):
+                    self.world[i][j] = 1
+
+            self.status = tiles.zeros((size, size), world_path)  # CellStatus.WALL
+            self.status[fov : fov + grid_size, fov : fov + grid_size] = np.where(
+                self.world == 1, CellStatus.HIDDEN_MINERAL, CellStatus.HIDDEN_EMPTY
+            )
+        # status without the walls, as a view
+        self.grid_status = self.status[fov : fov + grid_size, fov : fov + grid_size]
+        # As small as the number of agents allows, and only the cells of the
+        # agents are written so the untouched pages of a big map are never
+        # allocated
+        self.occupancy = tiles.zeros(
+            (size, size),
+            world_path and f"{world_path}.occupancy",
+            dtype=np.min_scalar_type(num_agent),
+        )
+        xs, ys = self.positions.T
+        self.occupancy[xs + fov, ys + fov] = np.arange(1, num_agent + 1)
+        # state code of every agent for step_batched, 0 is the code of the
+        # initial State([0]) of the agents
+        self.state_codes = [0] * num_agent
+        # symmetry each state code is seen through, see Agent.encode_states
+        self.state_symmetries = np.zeros(num_agent, dtype=np.intp)
+
+        # Running exploration counters, kept up to date by count_discoveries
+        # so reading them is free
+        self.num_cells = grid_size * grid_size
+        # mineral cells, of the generated tiles only with tile_size
+        self.num_veins = 0 if self.tiles else int(np.count_nonzero(self.world == 1))
+        self.cells_explored = 0
+        self.veins_found = 0
+        # step during which the last cell was discovered
+        self.last_discovery = -1
+        # total reward of every agent, in the order of agent_list
+        self.agent_rewards = np.zeros(num_agent)
+
+        self.frontier = None
+        if frontier:
+            self.frontier = FrontierField(self.grid_status, frontier, explored=False)
+        # agents whose last observation showed nothing new, kept by
+        # step_batched when there is a frontier
+        self.idle = np.ones(num_agent, dtype=bool)
+
+    @property
+    def coverage(self) -> float:
+        return self.cells_explored / self.num_cells
+
+    @property
+    def vein_recall(self) -> float:
+        return self.veins_found / self.num_veins if self.num_veins else 1.0
+
+    @property
+    def steps_without_discovery(self) -> int:
+        return self.steps - 1 - self.last_discovery
+
+    def generate_around(self, positions: np.ndarray, radius: int):
+        """
+        Makes sure the world is generated under the windows of radius around
+        (n, 2) positions before they are looked at, nothing to do unless the
+        world is tiled
+        """
+        if self.tiles is not None:
+            self.num_veins += self.tiles.generate_around(positions, radius)
 
-        # Initialize veins
-        self.world = generate_blobs(self.grid_size, self.grid_size, 0.1, 10)
-        for i in range(grid_size - 1, grid_size - 4, -1):
-            for j in range(grid_size - 1, grid_size - 4, -1):
-                self.world[i][j] = 1
+    def count_discoveries(self, looked: np.ndarray, cells=None):
+        """
+        Updates the exploration counters with the status of cells, before
+        they are observed. cells are their flat indices in status, when known.
+        """
+        explored = np.count_nonzero(looked >= CellStatus.HIDDEN_EMPTY)
+        if explored:
+            self.cells_explored += explored
+            self.veins_found += np.count_nonzero(looked == CellStatus.HIDDEN_MINERAL)
+            self.last_discovery = self.steps
+            if self.frontier is not None and cells is not None:
+                width = self.status.shape[-1]
+                cells = cells[looked >= CellStatus.HIDDEN_EMPTY]
+                self.frontier.discover(cells // width - self.fov, cells % width - self.fov)
+
+    def should_stop(self, target_coverage=None, patience=None) -> bool:
+        """
+        True once coverage reaches target_coverage or when nothing was
+        discovered during the last patience steps
+        """
+        if target_coverage is not None and self.coverage >= target_coverage:
+            return True
+        return patience is not None and self.steps_without_discovery >= patience
+
+    @property
+    def agents(self) -> dict:
+        """
+        {position: agent}, built from positions on every call
+        """
+        return dict(zip(map(tuple, self.positions.tolist()), self.agent_list))
 
     def valid_pos(self, pos: (int, int)) -> bool:
-        x, y = pos
-        valid_x = x >= 0 and x < self.grid_size
-        valid_y = y >= 0 and y < self.grid_size
-        another_agent_present = (x, y) in self.agents
-        return valid_x and valid_y and not another_agent_present
+        return not self.out_of_bound(pos) and not self.occupied(pos)
 
     def out_of_bound(self, pos: (int, int)) -> bool:
         x, y = pos
@@ -94,35 +290,99 @@ class GridEnv:
         return not (valid_x and valid_y)
 
     def occupied(self, pos: (int, int)) -> bool:
+        if self.out_of_bound(pos):
+            return False
+        x, y = pos
+        return bool(self.occupancy[x + self.fov, y + self.fov])
+
+    def agent_at(self, pos: (int, int)):
+        """
+        Agent standing on pos, None if there is none
+        """
+        if not self.occupied(pos):
+            return None
+        x, y = pos
+        return self.agent_list[self.occupancy[x + self.fov, y + self.fov] - 1]
+
+    def agents_within(self, pos: (int, int), radius: int) -> np.ndarray:
+        """
+        Ids of the agents in the (2 * radius + 1)² square centered on pos,
+        sorted. Only that square of occupancy is read.
+        """
+        x, y = pos
+        fov = self.fov
+        window = self.occupancy[
+            max(x - radius, 0) + fov : min(x + radius + 1, self.grid_size) + fov,
+            max(y - radius, 0) + fov : min(y + radius + 1, self.grid_size) + fov,
+        ]
+        return np.sort(window[window > 0]).astype(np.intp) - 1
+
+    def window(self, grid, pos: (int, int), radius: int) -> np.ndarray:
+        """
+        View of the (2 * radius + 1)² square centered on pos in one of the
+        padded arrays (status or occupancy)
+        """
         x, y = pos
-        another_agent_present = (x, y) in self.agents
-        return another_agent_present
-
-    def snapshot(self):
-        # self.memory.append(
-        #     {
-        #         "agents": [pos for pos, agent in self.agents.items()],
-        #         "discovered_empty": dict(self.discovered_empty),
-        #         "just_discovered_empty": dict(self.just_discovered_empty),
-        #         "discovered_vein": dict(self.discovered_vein),
-        #         "just_discovered_vein": dict(self.just_discovered_vein),
-        #     }
-        # )
-
-        self.memory.append(
-            {
-                "agents": [pos for pos, agent in self.agents.items()],
-                "discovered_empty": [pos for pos, _ in self.discovered_empty.items()],
-                "just_discovered_empty": [
-                    pos for pos, _ in self.just_discovered_empty.items()
-                ],
-                "discovered_vein": [pos for pos, _ in self.discovered_vein.items()],
-                "just_discovered_vein": [
-                    pos for pos, _ in self.just_discovered_vein.items()
-                ],
-            }
+        offset = self.fov - radius
+        size = 2 * radius + 1
+        return grid[x + offset : x + offset + size, y + offset : y + offset + size]
+
+    def move_agents(self, ids: np.ndarray, targets: np.ndarray):
+        """
+        Moves the agents ids to targets, only their old and new cells of
+        occupancy are written
+        """
+        fov = self.fov
+        xs, ys = self.positions[ids].T
+        self.occupancy[xs + fov, ys + fov] = 0
+        xs, ys = targets.T
+        self.occupancy[xs + fov, ys + fov] = ids + 1
+        self.positions[ids] = targets
+
+    def frame(self) -> Frame:
+        """
+        Current state as a Frame, the arrays are views on the environment
+        """
+        return Frame(self.grid_status, self.positions)
+
+    @property
+    def record_cadence(self):
+        return self.snapshot_every if self.record_every is None else self.record_every
+
+    def due(self, every, final=False) -> bool:
+        """
+        Whether a cadence (see snapshot_every) takes the current step, or
+        the final state of a run with final
+        """
+        if not every:
+            return False
+        if final:
+            return True
+        return every != "final" and self.steps % every == 0
+
+    def periodic_snapshot(self):
+        memory = self.due(self.snapshot_every)
+        recorder = self.recorder is not None and self.due(self.record_cadence)
+        if memory or recorder:
+            self.snapshot(memory, recorder)
+
+    def final_snapshot(self):
+        self.snapshot(
+            self.due(self.snapshot_every, final=True),
+            self.due(self.record_cadence, final=True),
         )
 
+    def snapshot(self, memory=True, recorder=True):
+        """
+        Adds the current state to memory and gives it to the recorder. The
+        recorder gets the views of frame(), never a copy of the whole map.
+        """
+        frame = self.frame()
+        if memory:
+            self.memory.record(*frame)
+        if recorder and self.recorder is not None:
+            self.recorder.record(frame)
+
     # backup function
     def render(self):
         fig, ax = plt.subplots()
@@ -167,81 +427,269 @@ class GridEnv:
         # Vérifier si la position est valide
         return new_position if self.valid_pos(new_position) else position
 
-    def step(self):
-        self.snapshot()
-        new_agent_positions = {}  # Dictionnaire pour stocker les nouvelles positions
+    def apply_actions(self, positions: np.ndarray, actions: np.ndarray) -> np.ndarray:
+        """
+        apply_action for (n, 2) positions at once
+        """
+        targets = positions + MOVES[actions]
+        inside = np.all((targets >= 0) & (targets < self.grid_size), axis=1)
+        targets[~inside] = positions[~inside]
+        taken = self.occupancy[targets[:, 0] + self.fov, targets[:, 1] + self.fov] > 0
+        free = inside & ~taken
+        return np.where(free[:, None], targets, positions)
+
+    def step_batched(self):
+        """
+        step() with every agent handled at once. Moves, conflicts and
+        discoveries are the same as step(), the Q-table updates of the swarm
+        are all computed from the table before the step.
+        """
+        metrics = self.metrics
+        start = metrics and metrics.start_step()
+        self.periodic_snapshot()
+        agent = self.template_agent
+        positions = self.positions
+        if metrics:
+            start = metrics.lap("snapshot", start)
+
+        if self.policy is not None:
+            actions = agent.greedy_actions(
+                self.policy, self.state_codes, self.state_symmetries
+            )
+        else:
+            actions = agent.choose_actions(self.state_codes, self.state_symmetries)
+        if self.frontier is not None:
+            idle = np.flatnonzero(self.idle)
+            hints = self.frontier.hints(positions[idle])
+            follow = hints >= 0
+            actions[idle[follow]] = hints[follow]
+        if metrics:
+            start = metrics.lap("choose_action", start)
+        targets = self.apply_actions(positions, actions)
+        if metrics:
+            start = metrics.lap("move", start)
+
+        states = agent.get_states(self, targets)
+        next_codes, next_symmetries = agent.encode_states(states)
+        if self.frontier is not None:
+            self.idle = ~np.any(states >= CellStatus.JUST_DISCOVERED_EMPTY, axis=1)
+        if metrics:
+            start = metrics.lap("observe", start)
+        rewards = agent.get_rewards(states)
+        self.agent_rewards += rewards
+        if self.policy is None:
+            agent.update_q_tables(
+                self.state_codes,
+                actions,
+                rewards,
+                next_codes,
+                self.state_symmetries,
+                self.replay,
+            )
+            if self.replay is not None:
+                agent.replay(self.replay)
+            agent.trim_q_table(self.replay)
+        self.state_codes = next_codes
+        self.state_symmetries = next_symmetries
+        if metrics:
+            start = metrics.lap("learn", start)
+
+        # The first agent to claim a cell gets it, the others stay in place
+        claims = targets[:, 0] * self.grid_size + targets[:, 1]
+        _, first = np.unique(claims, return_index=True)
+        lost = np.ones(len(claims), dtype=bool)
+        lost[first] = False
+        targets[lost] = positions[lost]
+
+        moved = np.flatnonzero(np.any(targets != positions, axis=1))
+        self.move_agents(moved, targets[moved])
+        self.steps += 1
+        if metrics:
+            metrics.lap("update_positions", start)
+            metrics.end_step(self)
 
-        for position, agent in list(self.agents.items()):
+    def step(self):
+        if self.batched:
+            return self.step_batched()
+
+        metrics = self.metrics
+        start = metrics and metrics.start_step()
+        self.periodic_snapshot()
+        if metrics:
+            start = metrics.lap("snapshot", start)
+        targets = self.positions.copy()  # nouvelles positions des agents
+        claimed = set()  # cases prises pendant ce pas
+
+        for i, (position, agent) in enumerate(
+            zip(map(tuple, self.positions.tolist()), self.agent_list)
+        ):
             state = agent.state
-            action = agent.choose_action(state, self)
+            if self.policy is not None:
+                action = agent.greedy_action(self.policy, state)
+            else:
+                action = agent.choose_action(state, self)
+            if self.frontier is not None and not np.any(
+                state.grid >= CellStatus.JUST_DISCOVERED_EMPTY
+            ):
+                hint = self.frontier.hints(position)[0]
+                if hint >= 0:
+                    action = hint
+            if metrics:
+                start = metrics.lap("choose_action", start)
 
             next_position = self.apply_action(position, agent, action)
+            if metrics:
+                start = metrics.lap("move", start)
 
             next_state = agent.get_state(self, next_position)
             agent.state = next_state
-            reward = next_state.get_reward()
+            reward = next_state.reward
+            self.agent_rewards[i] += reward
+            if metrics:
+                start = metrics.lap("observe", start)
 
             # Update q_table
-            agent.update_q_table(state, action, reward, next_state)
-
-            # Ajouter l'agent à sa nouvelle position seulement si elle est libre
-            if next_position not in new_agent_positions:
-                new_agent_positions[next_position] = agent
+            if self.policy is None:
+                agent.update_q_table(state, action, reward, next_state, self.replay)
+                if metrics:
+                    start = metrics.lap("learn", start)
+
+            # Déplacer l'agent seulement si sa nouvelle position est libre
+            if next_position not in claimed:
+                claimed.add(next_position)
+                targets[i] = next_position
             else:
-                new_agent_positions[position] = (
-                    agent  # Garde l'agent à sa position initiale
-                )
-
-        # Mettre à jour la grille des agents
-        self.agents = new_agent_positions
-
-    def train(self, num_steps=50, filename="agent.pkl"):
+                claimed.add(position)  # Garde l'agent à sa position initiale
+
+        if self.policy is None:
+            if self.replay is not None:
+                self.template_agent.replay(self.replay)
+                if metrics:
+                    start = metrics.lap("learn", start)
+            self.template_agent.trim_q_table(self.replay)
+
+        # Mettre à jour la grille des agents, seulement pour ceux qui bougent
+        moved = np.flatnonzero(np.any(targets != self.positions, axis=1))
+        self.move_agents(moved, targets[moved])
+        self.steps += 1
+        if metrics:
+            metrics.lap("update_positions", start)
+            metrics.end_step(self)
+
+    def train(
+        self,
+        num_steps=50,
+        filename="agent.qtb",
+        recorder=None,
+        checkpoint_every=None,
+        metrics=None,
+        snapshot_every=1,
+        target_coverage=None,
+        patience=None,
+        replay=None,
+        record_every=None,
+    ):
+        """
+        Trains the agents for num_steps, the Q-table is loaded from filename
+        before and saved after. With checkpoint_every, the rows changed are
+        also appended to filename every checkpoint_every steps.
+
+        snapshot_every sets which steps go to memory (and recorder): every
+        Nth step, none with 0 or only the final state with "final".
+        record_every sets the steps of the recorder alone, with the same
+        values: with snapshot_every=0 the frames go to the recorder without
+        being kept, which is what very large maps need.
+
+        Training stops early once coverage reaches target_coverage or when
+        no cell was discovered for patience steps, see should_stop.
+
+        With a replay.ReplayBuffer, every step learns minibatches of past
+        transitions instead of the transitions of the step.
+        Returns the number of steps done.
+        """
         # print("nb agents: ", len(self.agents))
-
+        self.recorder = recorder
+        self.snapshot_every = snapshot_every
+        self.record_every = record_every
+        self.replay = replay
+        self.policy = None
+        if metrics is not None:
+            self.metrics = metrics
+
+        start = self.metrics and time.perf_counter()
         try:
-            self.template_agent.load_q_table(filename)
+            self.template_agent.load_q_table(filename, self.replay)
         except FileNotFoundError:
             pass
+        if self.metrics:
+            self.metrics.lap("load_q_table", start)
 
+        first = self.steps
         for step in range(num_steps):
             self.step()
 
-            # world_copy = np.copy(self.world)
-
-            # for x, y in self.discovered_vein.keys():
-            #     world_copy[x][y] = 3
-            # for x, y in self.agents.keys():
-            #     world_copy[x][y] = 2
-
-            # Debug
-            # print(world_copy)
+            if checkpoint_every and (step + 1) % checkpoint_every == 0:
+                start = self.metrics and time.perf_counter()
+                self.template_agent.save_q_table(filename)
+                if self.metrics:
+                    self.metrics.lap("save_q_table", start)
+            if self.should_stop(target_coverage, patience):
+                break
 
+        start = self.metrics and time.perf_counter()
         self.template_agent.save_q_table(filename)
-        self.snapshot()
+        if self.metrics:
+            self.metrics.lap("save_q_table", start)
+        self.final_snapshot()
+        return self.steps - first
         # Debug
         # print("nb agents: ", len(self.agents))
         # print(self.memory)
 
-    def simulate(self, num_steps: int = 100, filename="agent.pkl"):
+    def simulate(
+        self,
+        num_steps: int = 100,
+        filename="agent.qtb",
+        recorder=None,
+        metrics=None,
+        snapshot_every=1,
+        target_coverage=None,
+        patience=None,
+        frozen=False,
+        tie_break="first",
+        seed=None,
+        record_every=None,
+    ):
+        """
+        Runs num_steps steps, or fewer with the stop conditions of train.
+        snapshot_every and record_every are the ones of train.
+        Returns the number of steps done.
+
+        With frozen, the Q-table is compiled into a greedy qtable.Policy
+        (tie_break and seed are given to QTable.compile) that the agents
+        follow without exploring nor updating the table.
+        """
+        self.recorder = recorder
+        self.snapshot_every = snapshot_every
+        self.record_every = record_every
+        if metrics is not None:
+            self.metrics = metrics
         try:
-            self.template_agent.load_q_table(filename)
+            self.template_agent.load_q_table(filename, self.replay)
         except FileNotFoundError:
             pass
+        self.policy = None
+        if frozen:
+            self.policy = self.template_agent.q_table.compile(tie_break, seed)
 
+        first = self.steps
         for step in range(num_steps):
             self.step()
+            if self.should_stop(target_coverage, patience):
+                break
 
-            world_copy = np.copy(self.world)
-
-            for x, y in self.discovered_vein.keys():
-                world_copy[x][y] = 3
-            for x, y in self.agents.keys():
-                world_copy[x][y] = 2
-
-            # Debug
-            # print(world_copy)
-
-        self.snapshot()
+        self.final_snapshot()
+        return self.steps - first
         # Debug
         # print("nb agents: ", len(self.agents))
         # print(self.memory)
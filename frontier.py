@@ -0,0 +1,146 @@
+import numpy as np
+
+from environment import CellStatus, MOVES
+
+
+def distance_field(sources: np.ndarray) -> np.ndarray:
+    """
+    4-connected (city block) distance of every cell to the nearest True
+    cell of sources, inf when there is none. There are no obstacles, so the
+    distance is separable: one forward and one backward sweep per axis.
+    """
+    field = np.where(sources, 0.0, np.inf)
+    for axis in (1, 0):
+        field = np.moveaxis(field, axis, 0)
+        for i in range(1, len(field)):
+            np.minimum(field[i], field[i - 1] + 1, out=field[i])
+        for i in reversed(range(len(field) - 1)):
+            np.minimum(field[i], field[i + 1] + 1, out=field[i])
+        field = np.moveaxis(field, 0, axis)
+    return field
+
+
+def direction(dx: np.ndarray, dy: np.ndarray) -> np.ndarray:
+    """
+    Action moving along the largest of dx and dy, the x axis on ties
+    """
+    along_x = np.abs(dx) >= np.abs(dy)
+    return np.where(
+        along_x,
+        np.where(dx > 0, 3, 2),  # RIGHT, LEFT
+        np.where(dy > 0, 1, 0),  # DOWN, UP
+    )
+
+
+class FrontierField:
+    """
+    Where the nearest unexplored cells are, to send the agents there.
+    ...
+
+    The map is cut in blocks of block_size² cells. Every block keeps how
+    many of its cells are unexplored (hidden, or not generated yet in a
+    TiledWorld), updated as they are discovered, and a distance field gives
+    for every block how many blocks away the nearest one with unexplored
+    cells is. The field is only computed again when a block becomes fully
+    explored.
+
+    Attributes
+    ----------
+    unexplored: np.ndarray
+      (blocks, blocks) unexplored cells of every block
+    field: np.ndarray
+      (blocks, blocks) distance in blocks to the nearest unexplored block
+
+    Methods
+    -------
+    discover(xs, ys)
+        Counts cells as explored
+    hints(positions)
+        Action towards the nearest unexplored cells from every position
+    """
+
+    def __init__(self, grid_status: np.ndarray, block_size: int = 8, explored=True):
+        """
+        grid_status is the unpadded status of the environment (a view, it
+        is read when hints are given). Without explored, every cell is taken
+        as unexplored instead of counting them.
+        """
+        self.grid_status = grid_status
+        self.block_size = block_size
+        grid_size = len(grid_status)
+        blocks = -(-grid_size // block_size)
+
+        # Cells per block, the last row and column of blocks may be smaller
+        sizes = np.minimum(block_size, grid_size - block_size * np.arange(blocks))
+        self.unexplored = np.outer(sizes, sizes)
+        if explored:
+            edges = np.arange(0, grid_size, block_size)
+            hidden = self.is_unexplored(grid_status).astype(np.int64)
+            hidden = np.add.reduceat(hidden, edges, axis=0)
+            self.unexplored = np.add.reduceat(hidden, edges, axis=1)
+        self.field = distance_field(self.unexplored > 0)
+        self.stale = False
+
+    @staticmethod
+    def is_unexplored(status: np.ndarray) -> np.ndarray:
+        return (status >= CellStatus.HIDDEN_EMPTY) | (status == CellStatus.WALL)
+
+    def discover(self, xs: np.ndarray, ys: np.ndarray):
+        bx, by = xs // self.block_size, ys // self.block_size
+        np.subtract.at(self.unexplored, (bx, by), 1)
+        if not self.unexplored[bx, by].all():
+            self.stale = True
+
+    def hints(self, positions: np.ndarray) -> np.ndarray:
+        """
+        Returns:
+        - np.ndarray: for every (x, y) of positions, the action towards the
+          nearest unexplored cell of its block or else towards the nearest
+          unexplored block, -1 once everything is explored.
+        """
+        if self.stale:
+            self.field = distance_field(self.unexplored > 0)
+            self.stale = False
+
+        size, grid_size = self.block_size, len(self.grid_status)
+        positions = np.asarray(positions).reshape(-1, 2)
+        xs, ys = positions[:, 0], positions[:, 1]
+        bx, by = xs // size, ys // size
+        hints = np.full(len(positions), -1)
+
+        # In a block with unexplored cells: towards the nearest one
+        local = np.flatnonzero(self.unexplored[bx, by] > 0)
+        if len(local):
+            offsets = np.arange(size)
+            rows = np.minimum(bx[local, None] * size + offsets, grid_size - 1)
+            cols = np.minimum(by[local, None] * size + offsets, grid_size - 1)
+            cells = self.grid_status[rows[:, :, None], cols[:, None, :]]
+            dx, dy = np.broadcast_arrays(
+                rows[:, :, None] - xs[local, None, None],
+                cols[:, None, :] - ys[local, None, None],
+            )
+            distance = np.where(
+                self.is_unexplored(cells), np.abs(dx) + np.abs(dy), np.inf
+            )
+            nearest = np.argmin(distance.reshape(len(local), -1), axis=1)
+            pick = np.arange(len(local))
+            hints[local] = direction(
+                dx.reshape(len(local), -1)[pick, nearest],
+                dy.reshape(len(local), -1)[pick, nearest],
+            )
+
+        # Else: towards the neighbour block closest to unexplored blocks
+        away = np.flatnonzero(self.unexplored[bx, by] == 0)
+        if len(away):
+            blocks = np.stack([bx[away], by[away]], axis=1)
+            neighbours = blocks[:, None, :] + MOVES
+            inside = np.all((neighbours >= 0) & (neighbours < len(self.field)), axis=2)
+            neighbours = np.clip(neighbours, 0, len(self.field) - 1)
+            distance = np.where(
+                inside, self.field[neighbours[..., 0], neighbours[..., 1]], np.inf
+            )
+            best = np.argmin(distance, axis=1)
+            closer = distance.min(axis=1) < self.field[blocks[:, 0], blocks[:, 1]]
+            hints[away[closer]] = best[closer]
+
+        return hints
@@ -0,0 +1,122 @@
+import csv
+import json
+import os
+import time
+
+import numpy as np
+
+from collections import defaultdict
+
+from environment import CellStatus
+
+
+def status_counts(status: np.ndarray, rows: int = 1024) -> np.ndarray:
+    """
+    Cells of every CellStatus value of the padded status (the padding only
+    adds WALL cells). bincount works on intp, so the rows are counted a
+    block at a time instead of converting the whole map at once.
+    """
+    counts = np.zeros(16, dtype=np.int64)
+    for start in range(0, len(status), rows):
+        counts += np.bincount(status[start : start + rows].reshape(-1), minlength=16)
+    return counts
+
+
+class Metrics:
+    """
+    Cumulative timers and counters of the phases of GridEnv.step.
+    ...
+
+    Give it to GridEnv.train or simulate (or set GridEnv.metrics). Every
+    `every` steps it samples the size of the Q-table, of the snapshot log and
+    the number of discovered cells, then calls callback(metrics), which can
+    dump them with to_json or to_csv.
+
+    Attributes
+    ----------
+    timers: defaultdict(float)
+      seconds spent in every phase
+    calls: defaultdict(int)
+      times every phase ran
+    gauges: dict
+      last sampled sizes and counts
+    steps: int
+      steps measured
+    """
+
+    def __init__(self, every: int = 100, callback=None):
+        self.every = every
+        self.callback = callback
+        self.timers = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.gauges = {}
+        self.steps = 0
+        self.step_start = None
+
+    def lap(self, phase: str, start: float) -> float:
+        """
+        Adds the time since start to phase, returns now to start the next one
+        """
+        now = time.perf_counter()
+        self.timers[phase] += now - start
+        self.calls[phase] += 1
+        return now
+
+    def start_step(self) -> float:
+        self.step_start = time.perf_counter()
+        return self.step_start
+
+    def end_step(self, env):
+        self.lap("step", self.step_start)
+        self.steps += 1
+        if self.every and self.steps % self.every == 0:
+            self.sample(env)
+            if self.callback is not None:
+                self.callback(self)
+
+    def sample(self, env):
+        q_table = env.template_agent.q_table
+        counts = status_counts(env.status)
+        self.gauges = {
+            "q_table_states": len(q_table),
+            "q_table_bytes": q_table.nbytes,
+            "q_table_hit_rate": q_table.hit_rate,
+            "q_table_evictions": q_table.evictions,
+            "snapshot_frames": len(env.memory),
+            "snapshot_bytes": env.memory.nbytes,
+            "coverage": env.coverage,
+            "vein_recall": env.vein_recall,
+            **{
+                name.lower(): int(counts[value])
+                for name, value in vars(CellStatus).items()
+                if not name.startswith("_") and name != "WALL"
+            },
+        }
+
+    def as_dict(self) -> dict:
+        return {
+            "steps": self.steps,
+            **{f"{phase}_seconds": t for phase, t in self.timers.items()},
+            **{f"{phase}_calls": n for phase, n in self.calls.items()},
+            **self.gauges,
+        }
+
+    def to_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+    def to_csv(self, path):
+        """
+        Appends the current metrics as one row. The header is written with
+        the first row and keeps the columns known at that time.
+        """
+        row = self.as_dict()
+        fieldnames = list(row)
+        if os.path.exists(path):
+            with open(path, newline="") as f:
+                fieldnames = next(csv.reader(f), fieldnames)
+        with open(path, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction="ignore")
+            if f.tell() == 0:
+                writer.writeheader()
+            writer.writerow(row)
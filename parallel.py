@@ -0,0 +1,131 @@
+import argparse
+import os
+import random
+import time
+
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+
+from agent import Agent
+from environment import GridEnv
+
+
+def run_episode(table, seed: int, num_steps: int, env_kwargs: dict):
+    """
+    Trains on one freshly generated world, starting from table.
+
+    Returns:
+    - the table.changes() of the episode, to be merged by the driver
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+    Agent.q_table = table
+    since = table.visits[: len(table)].copy()
+
+    env = GridEnv(seed=seed, **env_kwargs)
+    env.snapshot_every = 0  # nobody looks at the frames of the workers
+    for _ in range(num_steps):
+        env.step()
+
+    return table.changes(since)
+
+
+def train_parallel(
+    num_episodes: int = 32,
+    num_steps: int = 1000,
+    workers: int = None,
+    filename: str = "agent.qtb",
+    seed: int = 0,
+    **env_kwargs,
+):
+    """
+    Runs num_episodes independent GridEnv episodes in a process pool.
+
+    The episodes run in rounds of one episode per worker, all starting from
+    the shared Agent.q_table. After each round their Q-tables are merged back
+    into the shared one (see QTable.merge) which is sent to the next round.
+
+    Parameters:
+    - num_episodes (int): Number of episodes, each on a different world.
+    - num_steps (int): Steps per episode.
+    - workers (int): Size of the process pool, all the cores by default.
+    - filename (str): Q-table loaded before training and saved after.
+    - seed (int): Seed of the first episode, episode i uses seed + i.
+    - env_kwargs: Passed to every GridEnv.
+
+    Returns:
+    - dict: episodes, seconds and episodes_per_second of the whole run.
+    """
+    workers = workers or os.cpu_count()
+    agent = Agent()
+    try:
+        agent.load_q_table(filename)
+    except FileNotFoundError:
+        pass
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers) as pool:
+        for first in range(0, num_episodes, workers):
+            seeds = range(seed + first, seed + min(first + workers, num_episodes))
+            round_start = time.perf_counter()
+            changes = list(
+                pool.map(
+                    run_episode,
+                    [Agent.q_table] * len(seeds),
+                    seeds,
+                    [num_steps] * len(seeds),
+                    [env_kwargs] * len(seeds),
+                )
+            )
+            Agent.q_table.merge(changes)
+            Agent.q_table.trim()
+
+            elapsed = time.perf_counter() - round_start
+            print(
+                f"episodes {seeds.stop - seed}/{num_episodes}: "
+                f"{len(seeds) / elapsed:.2f} episodes/s, "
+                f"{len(Agent.q_table)} states"
+            )
+
+    seconds = time.perf_counter() - start
+    agent.save_q_table(filename)
+    return {
+        "episodes": num_episodes,
+        "seconds": seconds,
+        "episodes_per_second": num_episodes / seconds,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train agents on several cores")
+    parser.add_argument("--episodes", type=int, default=32)
+    parser.add_argument("--steps", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--filename", default="agent.qtb")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--grid-size", type=int, default=160)
+    parser.add_argument("--num-agent", type=int, default=10)
+    parser.add_argument("--fov", type=int, default=2)
+    parser.add_argument("--batched", action="store_true")
+    parser.add_argument("--symmetric", action="store_true")
+    parser.add_argument("--frontier", type=int, default=None, help="block size")
+    args = parser.parse_args()
+
+    stats = train_parallel(
+        num_episodes=args.episodes,
+        num_steps=args.steps,
+        workers=args.workers,
+        filename=args.filename,
+        seed=args.seed,
+        grid_size=args.grid_size,
+        num_agent=args.num_agent,
+        fov=args.fov,
+        batched=args.batched,
+        symmetric=args.symmetric,
+        frontier=args.frontier,
+        learning_rate=0.9,
+        discount_factor=0.94,
+        exploration_rate=0.2,
+    )
+    print(f"{stats['episodes_per_second']:.2f} episodes/s")
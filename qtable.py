@@ -0,0 +1,677 @@
+import numpy as np
+import pickle
+
+import checkpoint
+
+# Observation cells take the values 0 to 6 (see CellType), so an observation
+# is a number written in base 7, its first cell being the lowest digit
+BASE = 7
+# Number of base 7 digits that fit in a signed 64 bits integer
+DIGITS_PER_LIMB = 22
+LIMB = BASE**DIGITS_PER_LIMB
+POWERS = BASE ** np.arange(DIGITS_PER_LIMB, dtype=np.int64)
+
+NUM_ACTIONS = 4
+
+
+def encode_limbs(grids) -> np.ndarray:
+    """
+    (..., cells) observations as (..., limbs) int64, limb i holds the digits
+    of the cells 22 i to 22 i + 21. Comparing the limbs from the last one
+    compares the state codes.
+    """
+    grids = np.asarray(grids, dtype=np.int64)
+    return np.stack(
+        [
+            grids[..., start : start + DIGITS_PER_LIMB]
+            @ POWERS[: min(DIGITS_PER_LIMB, grids.shape[-1] - start)]
+            for start in range(0, max(grids.shape[-1], 1), DIGITS_PER_LIMB)
+        ],
+        axis=-1,
+    )
+
+
+def encode_many(grids) -> list:
+    """
+    Packs each row of grids into its base 7 state code.
+
+    Parameters:
+    - grids (array like): (n, cells) observations.
+
+    Returns:
+    - list: n python ints. Observations bigger than DIGITS_PER_LIMB cells are
+      packed 22 digits at a time in numpy and joined as python ints, so the
+      codes are exact for any fov.
+    """
+    grids = np.asarray(grids)
+    limbs = encode_limbs(grids.reshape(len(grids), -1))
+    codes = limbs[:, -1].astype(object)
+    for i in reversed(range(limbs.shape[1] - 1)):
+        codes = codes * LIMB + limbs[:, i]
+    return codes.tolist()
+
+
+def encode(grid) -> int:
+    return encode_many(np.asarray(grid).reshape(1, -1))[0]
+
+
+class QTable:
+    """
+    Q-values shared by the agents, one row of action values per state.
+    ...
+
+    Attributes
+    ----------
+    index: dict
+      state code -> row in values
+    codes: list
+      state code of every row
+    values: np.ndarray
+      (capacity, num_actions) float32, only the first len(self) rows are used.
+      The capacity doubles when it runs out.
+    visits: np.ndarray
+      (capacity, num_actions) uint32, number of updates of every value
+    uses: np.ndarray
+      (capacity,) float32, lookups of every row, halved at every trim
+    touched: np.ndarray
+      (capacity,) int64, clock of the last lookup of every row, the clock
+      ticks at every row() or rows() call
+    max_states: int
+      rows kept by trim(), None for no limit. max_bytes gives it as a memory
+      budget instead, see row_bytes.
+    policy: str
+      rows evicted first by trim(): "lfu" the least used (then the least
+      recently used), "lru" the least recently used
+    hits, misses: int
+      lookups of a state in the table (or its base) and of a new state
+    evictions: int
+      rows evicted so far
+
+    Methods
+    -------
+    learn(code, action, reward, next_code, learning_rate, discount_factor)
+        Q-learning update of (code, action)
+    learn_many(rows, actions, rewards, next_rows, learning_rate, discount_factor)
+        Q-learning update of a batch of transitions
+    update(other)
+        Copies the values of another QTable or of a legacy
+        {(grid, action): q} dict into this one
+    changes(since)
+        Rows updated since a previous visits array, to merge them later
+    merge(changes)
+        Visit weighted average of the changes of several copies of the table
+    load(path)
+        Reads a checkpoint (or a pickled table), see checkpoint.py
+    save(path)
+        Writes the whole table as a single chunk checkpoint
+    checkpoint(path)
+        Appends the rows changed since the last save to the checkpoint the
+        table was loaded from or saved to
+    trim()
+        Evicts rows once there are more than max_states, returns how the
+        rows were renumbered
+    compile(tie_break, seed)
+        Read-only greedy Policy of the table
+    """
+
+    # A checkpoint with more chunks than this is rewritten instead of appended to
+    MAX_CHUNKS = 16
+    # trim() keeps this fraction of max_states, so it does not run every step
+    TRIM_TO = 0.9
+    # Memory of a row outside the arrays: its python int code in codes and
+    # its entry in index
+    PYTHON_ROW_BYTES = 160
+
+    def __init__(
+        self,
+        num_actions: int = NUM_ACTIONS,
+        capacity: int = 1024,
+        max_states: int = None,
+        max_bytes: int = None,
+        policy: str = "lfu",
+    ):
+        if policy not in ("lfu", "lru"):
+            raise ValueError(f"unknown eviction policy {policy!r}")
+        self.num_actions = num_actions
+        self.index = {}
+        self.codes = []
+        self.values = np.zeros((capacity, num_actions), dtype=np.float32)
+        self.visits = np.zeros((capacity, num_actions), dtype=np.uint32)
+        # rows changed since the last save or checkpoint
+        self.dirty = np.zeros(capacity, dtype=bool)
+        self.uses = np.zeros(capacity, dtype=np.float32)
+        self.touched = np.zeros(capacity, dtype=np.int64)
+        self.clock = 0
+        self.policy = policy
+        self.max_states = max_states
+        if max_bytes is not None:
+            budget = max_bytes // self.row_bytes
+            self.max_states = budget if max_states is None else min(max_states, budget)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # checkpoint chunks (memory mapped) holding the rows not loaded yet,
+        # a row is copied in values the first time it is used
+        self.base = []
+        # checkpoint the base and the saved rows come from
+        self.source = None
+
+    def __len__(self):
+        """
+        Number of rows in memory, rows still in the base are not counted
+        """
+        return len(self.codes)
+
+    def __contains__(self, code):
+        return code in self.index or checkpoint.find(self.base, code) is not None
+
+    def __getstate__(self):
+        # Do not pickle the unused capacity, nor the budget: the copies sent
+        # to other processes must keep their rows (see changes)
+        self.materialize()
+        return {
+            "num_actions": self.num_actions,
+            "codes": self.codes,
+            "values": self.values[: len(self)],
+            "visits": self.visits[: len(self)],
+        }
+
+    def __setstate__(self, state):
+        self.num_actions = state["num_actions"]
+        self.codes = list(state["codes"])
+        self.index = {code: row for row, code in enumerate(self.codes)}
+        self.values = np.array(state["values"], dtype=np.float32)
+        self.visits = np.array(
+            state.get("visits", np.zeros(self.values.shape)), dtype=np.uint32
+        )
+        self.dirty = np.ones(len(self.codes), dtype=bool)
+        self.uses = np.zeros(len(self.codes), dtype=np.float32)
+        self.touched = np.zeros(len(self.codes), dtype=np.int64)
+        self.clock = 0
+        self.policy = "lfu"
+        self.max_states = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.base = []
+        self.source = None
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            self.values.nbytes
+            + self.visits.nbytes
+            + self.dirty.nbytes
+            + self.uses.nbytes
+            + self.touched.nbytes
+        )
+
+    @property
+    def row_bytes(self) -> int:
+        """
+        Estimated memory of a row, arrays and python objects
+        """
+        arrays = (self.values, self.visits, self.dirty, self.uses, self.touched)
+        row = sum(a.itemsize * int(np.prod(a.shape[1:])) for a in arrays)
+        return row + self.PYTHON_ROW_BYTES
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def clear(self):
+        self.index.clear()
+        self.codes.clear()
+        self.values[:] = 0
+        self.visits[:] = 0
+        self.dirty[:] = False
+        self.uses[:] = 0
+        self.touched[:] = 0
+        self.clock = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.base = []
+        self.source = None
+
+    @property
+    def cap(self):
+        """
+        Capacity of a bounded table, None for an unbounded one
+        """
+        if self.max_states is None:
+            return None
+        return self.max_states + self.max_states // 8
+
+    def _grow(self, size: int):
+        capacity = 2 * len(self.values)
+        # A bounded table only goes over max_states until the next trim, past
+        # the cap it doubles again so growing stays amortized
+        if self.cap is not None and size <= self.cap:
+            capacity = min(capacity, self.cap)
+        self._resize(max(size, capacity, 1))
+
+    def _resize(self, capacity: int):
+        values = np.zeros((capacity, self.num_actions), dtype=np.float32)
+        values[: len(self)] = self.values[: len(self)]
+        self.values = values
+        visits = np.zeros((capacity, self.num_actions), dtype=np.uint32)
+        visits[: len(self)] = self.visits[: len(self)]
+        self.visits = visits
+        dirty = np.zeros(capacity, dtype=bool)
+        dirty[: len(self)] = self.dirty[: len(self)]
+        self.dirty = dirty
+        uses = np.zeros(capacity, dtype=np.float32)
+        uses[: len(self)] = self.uses[: len(self)]
+        self.uses = uses
+        touched = np.zeros(capacity, dtype=np.int64)
+        touched[: len(self)] = self.touched[: len(self)]
+        self.touched = touched
+
+    def row(self, code: int) -> int:
+        """
+        Row of code, unknown codes get a row copied from the base or a zero row
+        """
+        row = self._row(code)
+        self.clock += 1
+        self.uses[row] += 1
+        self.touched[row] = self.clock
+        return row
+
+    def _row(self, code: int) -> int:
+        row = self.index.get(code)
+        if row is not None:
+            self.hits += 1
+        else:
+            row = len(self.codes)
+            if row == len(self.values):
+                self._grow(row + 1)
+            self.index[code] = row
+            self.codes.append(code)
+            found = checkpoint.find(self.base, code) if self.base else None
+            if found is not None:
+                self.values[row], self.visits[row] = found
+                self.hits += 1
+            else:
+                self.misses += 1
+        return row
+
+    def rows(self, codes) -> np.ndarray:
+        rows = np.fromiter((self._row(code) for code in codes), dtype=np.int64)
+        self.clock += 1
+        self.uses[rows] += 1
+        self.touched[rows] = self.clock
+        return rows
+
+    def get(self, code: int) -> np.ndarray:
+        """
+        Action values of code, zeros for unknown codes
+        """
+        row = self.index.get(code)
+        if row is not None:
+            return self.values[row]
+        found = checkpoint.find(self.base, code) if self.base else None
+        if found is not None:
+            return np.array(found[0])
+        return np.zeros(self.num_actions, dtype=np.float32)
+
+    def max_value(self, code: int) -> float:
+        return float(self.get(code).max())
+
+    def best_actions(self, code: int) -> np.ndarray:
+        """
+        All the actions sharing the best value of code
+        """
+        q_values = self.get(code)
+        return np.flatnonzero(q_values == q_values.max())
+
+    def greedy(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Best action of each row, ties are broken randomly
+        """
+        q_values = self.values[rows]
+        best = q_values == q_values.max(axis=1, keepdims=True)
+        return np.argmax(best * np.random.random(best.shape), axis=1)
+
+    def learn(
+        self,
+        code: int,
+        action: int,
+        reward: float,
+        next_code,
+        learning_rate: float,
+        discount_factor: float,
+    ):
+        row = self.row(code)
+        next_max = self.max_value(next_code) if next_code is not None else 0
+        current_q = self.values[row, action]
+        self.values[row, action] = current_q + learning_rate * (
+            reward + discount_factor * next_max - current_q
+        )
+        self.visits[row, action] += 1
+        self.dirty[row] = True
+
+    def learn_many(
+        self,
+        rows: np.ndarray,
+        actions: np.ndarray,
+        rewards: np.ndarray,
+        next_rows: np.ndarray,
+        learning_rate: float,
+        discount_factor: float,
+    ):
+        """
+        learn() for a batch of transitions, all computed from the values
+        before the batch. When a (row, action) pair appears more than once
+        the last transition wins.
+        """
+        next_max = self.values[next_rows].max(axis=1)
+        current_q = self.values[rows, actions]
+        self.values[rows, actions] = current_q + learning_rate * (
+            rewards + discount_factor * next_max - current_q
+        )
+        np.add.at(self.visits, (rows, actions), 1)
+        self.dirty[rows] = True
+
+    def update(self, other):
+        if isinstance(other, QTable):
+            other.materialize()
+            rows = self.rows(other.codes)
+            self.values[rows] = other.values[: len(other)]
+            self.visits[rows] = other.visits[: len(other)]
+            self.dirty[rows] = True
+            return
+
+        # Legacy table: {(tuple(grid), action): q}
+        for (grid, action), q in other.items():
+            row = self.row(encode(grid))
+            self.values[row, action] = q
+            self.dirty[row] = True
+
+    def changes(self, since: np.ndarray):
+        """
+        (codes, values, visits) of the rows updated since the visits array
+        since was copied. The visits are the number of updates since then.
+        """
+        visits = self.visits[: len(self)].astype(np.int64)
+        visits[: len(since)] -= since
+        rows = np.flatnonzero(visits.any(axis=1))
+        return [self.codes[row] for row in rows], self.values[rows], visits[rows]
+
+    def merge(self, changes: list):
+        """
+        Merges the changes() of several copies of this table. Each value
+        becomes the average of the copies that updated it, weighted by how
+        many times they did, values nobody updated are left as is.
+        """
+        if not changes:
+            return
+        codes = [code for c, _, _ in changes for code in c]
+        values = np.concatenate([v for _, v, _ in changes])
+        visits = np.concatenate([n for _, _, n in changes]).astype(np.float64)
+
+        rows = self.rows(codes)
+        total = np.zeros((len(self), self.num_actions))
+        weighted = np.zeros((len(self), self.num_actions))
+        np.add.at(total, rows, visits)
+        np.add.at(weighted, rows, visits * values)
+
+        updated = total > 0
+        self.values[: len(self)][updated] = weighted[updated] / total[updated]
+        self.visits[: len(self)] += total.astype(np.uint32)
+        self.dirty[: len(self)] |= updated.any(axis=1)
+
+    def materialize(self):
+        """
+        Copies every row still in the base into memory
+        """
+        for chunk in reversed(self.base):
+            codes = checkpoint.unpack_codes(chunk.keys)
+            new = np.fromiter((code not in self.index for code in codes), dtype=bool)
+            codes = [code for code, n in zip(codes, new) if n]
+            start = len(self)
+            if start + len(codes) > len(self.values):
+                self._grow(start + len(codes))
+            self.index.update(zip(codes, range(start, start + len(codes))))
+            self.codes.extend(codes)
+            self.values[start : len(self)] = chunk.values[new]
+            self.visits[start : len(self)] = chunk.visits[new]
+        self.base = []
+
+    def load(self, path):
+        """
+        Loads a checkpoint, or a pickled QTable or legacy dict.
+
+        An empty table, a table already mapping a checkpoint or one loading
+        the checkpoint it comes from only maps the checkpoint and reads its
+        rows when they are used: the rows in memory that were not changed
+        since the last save are dropped, the changed ones are kept over the
+        file's. A table with rows of its own gets the rows of the file copied
+        over them. Either way the lookups, uses and clock are left alone.
+
+        Returns:
+        - np.ndarray: the remap of the rows (see trim) when rows were dropped,
+          for a ReplayBuffer, else None.
+        """
+        if not checkpoint.is_checkpoint(path):
+            with open(path, "rb") as f:
+                self.update(pickle.load(f))
+            return None
+
+        num_actions, chunks = checkpoint.read(path)
+        if num_actions != self.num_actions:
+            raise ValueError(f"{path} has {num_actions} actions, not {self.num_actions}")
+        if not len(self) or self.base or path == self.source:
+            remap = None
+            if not self.dirty[: len(self)].all():
+                remap = self._pack(self.dirty[: len(self)])
+            self.base = chunks
+            self.source = path
+            return remap
+
+        for chunk in chunks:
+            codes = checkpoint.unpack_codes(chunk.keys)
+            new = [code for code in codes if code not in self.index]
+            start = len(self)
+            if start + len(new) > len(self.values):
+                self._grow(start + len(new))
+            self.index.update(zip(new, range(start, start + len(new))))
+            self.codes.extend(new)
+            rows = np.fromiter((self.index[code] for code in codes), dtype=np.int64)
+            self.values[rows] = chunk.values
+            self.visits[rows] = chunk.visits
+            self.dirty[rows] = False
+        return None
+
+    def save(self, path):
+        self.materialize()
+        checkpoint.create(
+            path,
+            self.num_actions,
+            self.codes,
+            self.values[: len(self)],
+            self.visits[: len(self)],
+        )
+        self.dirty[:] = False
+        self.source = path
+
+    def checkpoint(self, path):
+        """
+        Appends the changed rows to path when it is where the table comes
+        from, else saves the whole table there
+        """
+        if path != self.source or not checkpoint.is_checkpoint(path):
+            return self.save(path)
+
+        _, chunks = checkpoint.read(path)
+        if len(chunks) >= self.MAX_CHUNKS:
+            return self.save(path)
+
+        rows = np.flatnonzero(self.dirty[: len(self)])
+        if len(rows):
+            checkpoint.append(
+                path,
+                [self.codes[row] for row in rows],
+                self.values[rows],
+                self.visits[rows],
+            )
+        self.dirty[:] = False
+
+    def _pack(self, keep: np.ndarray) -> np.ndarray:
+        """
+        Keeps the rows where the bool array keep is True, packed at the start
+        of the arrays in the same order
+
+        Returns:
+        - np.ndarray: new row of every old row, -1 for the dropped ones.
+        """
+        size = len(self)
+        keep = np.flatnonzero(keep)
+        kept = len(keep)
+        remap = np.full(size, -1, dtype=np.int64)
+        remap[keep] = np.arange(kept)
+        for array in (self.values, self.visits, self.dirty, self.uses, self.touched):
+            array[:kept] = array[keep]
+            array[kept:size] = 0
+        self.codes = [self.codes[row] for row in keep.tolist()]
+        self.index = dict(zip(self.codes, range(kept)))
+        return remap
+
+    def trim(self):
+        """
+        Once there are more than max_states rows, evicts rows down to TRIM_TO
+        of max_states, in the order of the policy, and packs the rows left at
+        the start of the arrays. The uses are halved after each trim, so the
+        states used long ago end up evicted too. Evicted rows that were not
+        saved are lost, a state that comes back starts from its value in the
+        base or from zeros.
+
+        Rows must not be held across a trim, except by a ReplayBuffer given
+        the remap.
+
+        Returns:
+        - np.ndarray: new row of every old row, -1 for the evicted ones, or
+          None when nothing was evicted.
+        """
+        size = len(self)
+        if self.max_states is None or size <= self.max_states:
+            return None
+
+        kept = int(self.max_states * self.TRIM_TO)
+        touched = self.touched[:size]
+        if self.policy == "lru":
+            order = np.argsort(touched, kind="stable")
+        else:
+            order = np.lexsort((touched, self.uses[:size]))
+        keep = np.ones(size, dtype=bool)
+        keep[order[: size - kept]] = False
+        remap = self._pack(keep)
+        if self.policy == "lfu":
+            self.uses[:kept] /= 2
+        self.evictions += size - kept
+        if len(self.values) > 2 * self.cap:
+            self._resize(self.cap)  # after a big load or merge
+        return remap
+
+    def compile(self, tie_break: str = "first", seed=None):
+        """
+        Greedy Policy of every state of the table, the rows still in the base
+        included, without changing the table.
+
+        Parameters:
+        - tie_break (str): "first" picks the first of the best actions, "random"
+          one of them at random, drawn once per state.
+        - seed: Seed of the random ties, and of the actions of unknown states.
+
+        Returns:
+        - Policy
+        """
+        if tie_break not in ("first", "random"):
+            raise ValueError(f"unknown tie break {tie_break!r}")
+        rng = np.random.default_rng(seed)
+        # Like materialize: the last chunks win, the rows in memory last
+        codes, values = [], []
+        for chunk in self.base:
+            codes.extend(checkpoint.unpack_codes(chunk.keys))
+            values.append(np.asarray(chunk.values))
+        codes.extend(self.codes)
+        values.append(self.values[: len(self)])
+        values = np.concatenate(values)
+
+        best = values == values.max(axis=1, keepdims=True)
+        if tie_break == "random":
+            best = best * rng.random(best.shape)
+        return Policy(codes, np.argmax(best, axis=1), self.num_actions, tie_break, rng)
+
+
+class Policy:
+    """
+    Best action of every state of a QTable, see QTable.compile. Looking
+    actions up never changes the table, nor the policy.
+    ...
+
+    States the table did not have get the first action, or a random one
+    with the "random" tie break, like their zero row would.
+
+    Attributes
+    ----------
+    best: dict
+      state code -> best action
+    tie_break: str
+      "first" or "random"
+    unknown: int
+      lookups of states that are not in the policy
+
+    Methods
+    -------
+    action(code)
+        Best action of a state
+    actions(codes)
+        Best actions of several states
+    """
+
+    def __init__(
+        self, codes, actions, num_actions=NUM_ACTIONS, tie_break="first", seed=None
+    ):
+        self.best = dict(zip(codes, np.asarray(actions).tolist()))
+        self.num_actions = num_actions
+        self.tie_break = tie_break
+        self.rng = np.random.default_rng(seed)
+        self.unknown = 0
+
+    def __len__(self):
+        return len(self.best)
+
+    def action(self, code: int) -> int:
+        action = self.best.get(code)
+        if action is None:
+            self.unknown += 1
+            if self.tie_break == "first":
+                return 0
+            return int(self.rng.integers(self.num_actions))
+        return action
+
+    def actions(self, codes) -> np.ndarray:
+        return np.fromiter(
+            (self.action(code) for code in codes), dtype=np.int64, count=len(codes)
+        )
+
+
+def convert(source, destination):
+    """
+    Converts a pickled table (legacy agent.pkl files included) to a checkpoint
+    """
+    table = QTable()
+    table.load(source)
+    table.save(destination)
+    return table
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 3:
+        sys.exit(f"usage: {sys.argv[0]} agent.pkl agent.qtb")
+    table = convert(sys.argv[1], sys.argv[2])
+    print(f"{len(table)} states written to {sys.argv[2]}")
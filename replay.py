@@ -0,0 +1,123 @@
+import numpy as np
+
+
+class ReplayBuffer:
+    """
+    Ring of the last capacity transitions of a QTable, learned again in
+    random minibatches with QTable.learn_many.
+    ...
+
+    The states are stored as their rows in the QTable rather than their
+    codes, which are python ints of any size. The rows of a table only
+    change when it is cleared, the buffer must be cleared with it, or
+    trimmed or reloaded, the buffer must then be given the remap (see
+    Agent.trim_q_table and Agent.load_q_table).
+
+    Attributes
+    ----------
+    capacity: int
+      transitions kept, the oldest ones are overwritten
+    batch_size: int
+      transitions per minibatch
+    updates: int
+      minibatches learned by every learn() call
+    warmup: int
+      learn() does nothing before the buffer holds that many transitions
+    added: int
+      transitions added so far
+    replayed: int
+      transitions learned so far
+
+    Methods
+    -------
+    add(rows, actions, rewards, next_rows)
+        Appends a batch of transitions
+    sample(batch_size)
+        Random indices of stored transitions, uniform and with replacement
+    learn(q_table, learning_rate, discount_factor)
+        Q-learning update of updates random minibatches
+    remap(remap)
+        Follows the rows renumbered by QTable.trim or QTable.load
+    """
+
+    def __init__(
+        self,
+        capacity: int = 2**16,
+        batch_size: int = 256,
+        updates: int = 1,
+        warmup: int = None,
+        seed=None,
+    ):
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.updates = updates
+        self.warmup = batch_size if warmup is None else warmup
+        # Its own generator, replaying does not change the draws of the agents
+        self.rng = np.random.default_rng(seed)
+        self.rows = np.zeros(capacity, dtype=np.int64)
+        self.actions = np.zeros(capacity, dtype=np.uint8)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.next_rows = np.zeros(capacity, dtype=np.int64)
+        self.size = 0
+        self.position = 0  # next slot written
+        self.added = 0
+        self.replayed = 0
+
+    def __len__(self):
+        return self.size
+
+    def clear(self):
+        self.size = 0
+        self.position = 0
+
+    def add(self, rows, actions, rewards, next_rows):
+        rows = np.asarray(rows)[-self.capacity :]
+        count = len(rows)
+        slots = (self.position + np.arange(count)) % self.capacity
+        self.rows[slots] = rows
+        self.actions[slots] = np.asarray(actions)[-count:]
+        self.rewards[slots] = np.asarray(rewards)[-count:]
+        self.next_rows[slots] = np.asarray(next_rows)[-count:]
+        self.position = (self.position + count) % self.capacity
+        self.size = min(self.size + count, self.capacity)
+        self.added += count
+
+    def remap(self, remap: np.ndarray):
+        """
+        Renumbers the rows with the remap returned by QTable.trim, the
+        transitions with an evicted state are dropped. The ones left are
+        packed from the oldest.
+        """
+        order = (self.position - self.size + np.arange(self.size)) % self.capacity
+        rows, next_rows = remap[self.rows[order]], remap[self.next_rows[order]]
+        kept = (rows >= 0) & (next_rows >= 0)
+        count = int(kept.sum())
+        self.actions[:count] = self.actions[order[kept]]
+        self.rewards[:count] = self.rewards[order[kept]]
+        self.rows[:count] = rows[kept]
+        self.next_rows[:count] = next_rows[kept]
+        self.size = count
+        self.position = count % self.capacity
+
+    def sample(self, batch_size: int = None) -> np.ndarray:
+        return self.rng.integers(0, self.size, batch_size or self.batch_size)
+
+    def learn(self, q_table, learning_rate: float, discount_factor: float) -> int:
+        """
+        Returns:
+        - int: the number of transitions learned, 0 during the warmup.
+        """
+        if self.size == 0 or self.size < self.warmup:
+            return 0
+        for _ in range(self.updates):
+            batch = self.sample()
+            q_table.learn_many(
+                self.rows[batch],
+                self.actions[batch],
+                self.rewards[batch],
+                self.next_rows[batch],
+                learning_rate,
+                discount_factor,
+            )
+        self.replayed += self.updates * self.batch_size
+        return self.updates * self.batch_size
@@ -0,0 +1,155 @@
+import numpy as np
+
+from typing import NamedTuple
+
+
+class Frame(NamedTuple):
+    """
+    State of the environment at one step
+
+    status: (grid_size, grid_size) CellStatus of every cell
+    positions: (num_agent, 2) position of every agent
+    """
+
+    status: np.ndarray
+    positions: np.ndarray
+
+
+class Buffer:
+    """
+    Append only typed array that doubles its capacity when it is full
+    """
+
+    def __init__(self, dtype, shape=(), capacity=1024):
+        self.data = np.zeros((capacity, *shape), dtype=dtype)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def extend(self, values):
+        end = self.size + len(values)
+        if end > len(self.data):
+            shape = (max(end, 2 * len(self.data)), *self.data.shape[1:])
+            data = np.zeros(shape, dtype=self.data.dtype)
+            data[: self.size] = self.data[: self.size]
+            self.data = data
+        self.data[self.size : end] = values
+        self.size = end
+
+    def view(self, start=0, end=None):
+        return self.data[start : self.size if end is None else end]
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+
+class SnapshotLog:
+    """
+    Log of the frames of an episode that only stores what changed.
+    ...
+
+    Every frame records the cells whose status changed and the agents that
+    moved since the previous frame. A full copy of the frame is kept every
+    keyframe_every frames so that any frame can be rebuilt from the keyframe
+    before it plus at most keyframe_every - 1 deltas.
+
+    Methods
+    -------
+    record(status, positions)
+        Adds a frame at the end of the log
+    __getitem__(k)
+        Rebuilds frame k
+    __iter__()
+        Frames in order, rebuilding each one from the previous one
+    """
+
+    def __init__(self, keyframe_every: int = 100):
+        self.keyframe_every = keyframe_every
+        self.keyframes = []
+        # Frame k changed cells[cell_starts[k] : cell_starts[k + 1]]
+        self.cells = Buffer(np.uint32)
+        self.values = Buffer(np.uint8)
+        self.cell_starts = Buffer(np.int64)
+        # Frame k moved movers[move_starts[k] : move_starts[k + 1]]
+        self.movers = Buffer(np.uint32)
+        self.moves = Buffer(np.int32, (2,))
+        self.move_starts = Buffer(np.int64)
+        self.last = None
+
+    def __len__(self):
+        return len(self.cell_starts)
+
+    @property
+    def nbytes(self) -> int:
+        buffers = (
+            self.cells,
+            self.values,
+            self.cell_starts,
+            self.movers,
+            self.moves,
+            self.move_starts,
+        )
+        frames = list(self.keyframes)
+        if self.last is not None:
+            frames.append(self.last)  # the frame the next one is diffed against
+        frames = sum(f.status.nbytes + f.positions.nbytes for f in frames)
+        return sum(b.nbytes for b in buffers) + frames
+
+    def record(self, status: np.ndarray, positions: np.ndarray):
+        self.cell_starts.extend([len(self.cells)])
+        self.move_starts.extend([len(self.movers)])
+
+        if self.last is None:
+            self.last = Frame(np.array(status), np.array(positions))
+        else:
+            diff = status != self.last.status
+            moved = np.flatnonzero(np.any(positions != self.last.positions, axis=1))
+            self.cells.extend(np.flatnonzero(diff))
+            self.values.extend(status[diff])
+            self.movers.extend(moved)
+            self.moves.extend(positions[moved])
+            self.last.status[diff] = status[diff]
+            self.last.positions[moved] = positions[moved]
+
+        if (len(self) - 1) % self.keyframe_every == 0:
+            self.keyframes.append(
+                Frame(self.last.status.copy(), self.last.positions.copy())
+            )
+
+    def _apply(self, frame: Frame, k: int):
+        """
+        Turns frame k - 1 into frame k in place
+        """
+        cells = slice(*self._bounds(self.cell_starts, self.cells, k))
+        frame.status.reshape(-1)[self.cells.view()[cells]] = self.values.view()[cells]
+        moves = slice(*self._bounds(self.move_starts, self.movers, k))
+        frame.positions[self.movers.view()[moves]] = self.moves.view()[moves]
+
+    @staticmethod
+    def _bounds(starts: Buffer, buffer: Buffer, k: int):
+        end = starts.view()[k + 1] if k + 1 < len(starts) else len(buffer)
+        return starts.view()[k], end
+
+    def __getitem__(self, k: int) -> Frame:
+        if k < 0:
+            k += len(self)
+        if not 0 <= k < len(self):
+            raise IndexError("frame index out of range")
+
+        key = k // self.keyframe_every
+        frame = self.keyframes[key]
+        frame = Frame(frame.status.copy(), frame.positions.copy())
+        for i in range(key * self.keyframe_every + 1, k + 1):
+            self._apply(frame, i)
+        return frame
+
+    def __iter__(self):
+        if not len(self):
+            return
+        frame = self[0]
+        yield Frame(frame.status.copy(), frame.positions.copy())
+        for k in range(1, len(self)):
+            self._apply(frame, k)
+            yield Frame(frame.status.copy(), frame.positions.copy())
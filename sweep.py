@@ -0,0 +1,286 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import random
+import time
+
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from agent import Agent, StateCache
+from environment import GridEnv
+from qtable import QTable
+
+# Les combinaisons qui étaient en commentaire dans main.py
+SPACE = {
+    "fov": [2, 3],
+    "grid_size": [160, 200],
+    "learning_rate": [0.9],
+    "discount_factor": [0.94, 0.99],
+    "exploration_rate": [0.2, 0.3],
+}
+
+
+def grid_search(space: dict) -> list:
+    """
+    Every combination of the values of space, {name: [values]}
+    """
+    names = list(space)
+    return [
+        dict(zip(names, values))
+        for values in itertools.product(*(space[name] for name in names))
+    ]
+
+
+def random_search(space: dict, samples: int, seed: int = 0) -> list:
+    """
+    samples random configurations of space, {name: [values] or (low, high)}:
+    a value is picked from a list, drawn uniformly in a (low, high) range (an
+    int when both bounds are). The same seed gives the same configurations,
+    so an interrupted sweep can be resumed.
+    """
+    rng = random.Random(seed)
+    configs = []
+    for _ in range(samples):
+        config = {}
+        for name, values in space.items():
+            if isinstance(values, tuple):
+                low, high = values
+                if isinstance(low, int) and isinstance(high, int):
+                    config[name] = rng.randint(low, high)
+                else:
+                    config[name] = rng.uniform(low, high)
+            else:
+                config[name] = rng.choice(values)
+        configs.append(config)
+    return configs
+
+
+def run_id(run: dict) -> str:
+    return hashlib.sha1(json.dumps(run, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def run_config(
+    config: dict,
+    seed: int,
+    train_steps: int,
+    simulate_steps: int,
+    simulate_exploration_rate: float,
+    filename: str,
+) -> dict:
+    """
+    Trains a new Q-table with config on the world of seed, then simulates on
+    the world of seed + 1 with simulate_exploration_rate.
+
+    Returns:
+    - dict: coverage, vein_recall, steps and steps_per_second of the
+      simulation, train_steps_per_second and the states of the Q-table.
+    """
+    # The workers of a pool run several configurations
+    Agent.q_table = QTable()
+    Agent.states = StateCache()
+    random.seed(seed)
+    np.random.seed(seed)
+    if os.path.exists(filename):
+        os.remove(filename)  # left by an interrupted sweep
+
+    env = GridEnv(seed=seed, **config)
+    start = time.perf_counter()
+    done = env.train(train_steps, filename=filename, snapshot_every=0)
+    train_seconds = time.perf_counter() - start
+
+    config = {**config, "exploration_rate": simulate_exploration_rate}
+    env = GridEnv(seed=seed + 1, **config)
+    start = time.perf_counter()
+    steps = env.simulate(simulate_steps, filename=filename, snapshot_every=0)
+    seconds = time.perf_counter() - start
+
+    return {
+        "coverage": env.coverage,
+        "vein_recall": env.vein_recall,
+        "reward": float(env.agent_rewards.sum()),
+        "steps": steps,
+        "steps_per_second": steps / seconds,
+        "train_steps_per_second": done / train_seconds,
+        "states": len(Agent.q_table),
+    }
+
+
+def load_results(path: str) -> list:
+    """
+    The runs of a results file, a JSON object per line. A line cut by an
+    interruption is ignored, its run is done again.
+    """
+    results = []
+    try:
+        with open(path) as file:
+            for line in file:
+                try:
+                    results.append(json.loads(line))
+                except json.JSONDecodeError:
+                    pass
+    except FileNotFoundError:
+        pass
+    return results
+
+
+def sweep(
+    configs: list,
+    results: str = "sweep.jsonl",
+    directory: str = "sweep",
+    repeats: int = 1,
+    seed: int = 0,
+    train_steps: int = 1000,
+    simulate_steps: int = 1000,
+    simulate_exploration_rate: float = 0.01,
+    workers: int = None,
+) -> list:
+    """
+    Runs every configuration repeats times (with seeds seed, seed + 2, ...)
+    in a process pool, see run_config.
+
+    Every run finished is appended to the results file right away, with its
+    config, seed, id and the Q-table it trained (directory/<id>.qtb). The runs
+    already in the file are skipped, running the same sweep again after an
+    interruption only does the missing ones.
+
+    Parameters:
+    - configs (list): GridEnv keyword arguments of every configuration, see
+      grid_search and random_search.
+    - results (str): Results file.
+    - directory (str): Where the Q-tables go.
+    - workers (int): Size of the process pool, all the cores by default.
+
+    Returns:
+    - list: the results of the whole sweep, including the earlier ones.
+    """
+    steps = {
+        "train_steps": train_steps,
+        "simulate_steps": simulate_steps,
+        "simulate_exploration_rate": simulate_exploration_rate,
+    }
+    runs = []
+    for config in configs:
+        for repeat in range(repeats):
+            run = {"config": config, "seed": seed + 2 * repeat, **steps}
+            runs.append({"id": run_id(run), **run})
+
+    done = {result["id"]: result for result in load_results(results)}
+    todo = [run for run in runs if run["id"] not in done]
+    finished = len(runs) - len(todo)
+    print(f"{finished}/{len(runs)} runs already done")
+    os.makedirs(directory, exist_ok=True)
+    if os.path.exists(results) and os.path.getsize(results):
+        with open(results, "rb+") as file:
+            file.seek(-1, os.SEEK_END)
+            if file.read(1) != b"\n":
+                file.write(b"\n")  # ends the line cut by an interruption
+
+    with ProcessPoolExecutor(workers or os.cpu_count()) as pool, open(
+        results, "a"
+    ) as file:
+        futures = {
+            pool.submit(
+                run_config,
+                run["config"],
+                run["seed"],
+                train_steps,
+                simulate_steps,
+                simulate_exploration_rate,
+                os.path.join(directory, f"{run['id']}.qtb"),
+            ): run
+            for run in todo
+        }
+        for future in as_completed(futures):
+            run = futures[future]
+            try:
+                result = {**run, **future.result()}
+            except Exception as error:
+                # Not written, it is tried again when the sweep is resumed
+                print(f"run {run['id']} {run['config']} failed: {error!r}")
+                continue
+            file.write(json.dumps(result) + "\n")
+            file.flush()
+            done[run["id"]] = result
+            finished += 1
+            print(
+                f"{finished}/{len(runs)} {run['config']}: "
+                f"coverage {result['coverage']:.3f}, "
+                f"vein recall {result['vein_recall']:.3f}, "
+                f"{result['steps_per_second']:.1f} steps/s"
+            )
+
+    return [done[run["id"]] for run in runs if run["id"] in done]
+
+
+def parse_value(text: str):
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return text
+
+
+def parse_space(params: list) -> dict:
+    """
+    name=v1,v2,... is a list of values and name=low:high a range for
+    random_search
+    """
+    space = {}
+    for param in params:
+        name, values = param.split("=", 1)
+        if ":" in values:
+            space[name] = tuple(parse_value(v) for v in values.split(":", 1))
+        else:
+            space[name] = [parse_value(v) for v in values.split(",")]
+    return space
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Train and simulate GridEnv configurations on several cores"
+    )
+    parser.add_argument(
+        "params",
+        nargs="*",
+        help="name=v1,v2 (values) or name=low:high (random range), "
+        "replaces the default space",
+    )
+    parser.add_argument(
+        "--random", type=int, default=None, help="random search of N samples"
+    )
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--train-steps", type=int, default=1000)
+    parser.add_argument("--simulate-steps", type=int, default=1000)
+    parser.add_argument("--simulate-exploration-rate", type=float, default=0.01)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--results", default="sweep.jsonl")
+    parser.add_argument("--directory", default="sweep")
+    args = parser.parse_args()
+
+    space = parse_space(args.params) if args.params else SPACE
+    if args.random is not None:
+        configs = random_search(space, args.random, args.seed)
+    else:
+        configs = grid_search(space)
+
+    results = sweep(
+        configs,
+        results=args.results,
+        directory=args.directory,
+        repeats=args.repeats,
+        seed=args.seed,
+        train_steps=args.train_steps,
+        simulate_steps=args.simulate_steps,
+        simulate_exploration_rate=args.simulate_exploration_rate,
+        workers=args.workers,
+    )
+    print("best:")
+    for result in sorted(results, key=lambda r: -r["coverage"])[:5]:
+        print(
+            f"  {result['config']}: coverage {result['coverage']:.3f}, "
+            f"vein recall {result['vein_recall']:.3f}"
+        )
@@ -0,0 +1,123 @@
+import numpy as np
+
+from environment import CellStatus
+
+
+def zeros(shape, path=None, dtype=np.uint8) -> np.ndarray:
+    """
+    Array of zeros, memory mapped on path when given. Either way the pages
+    are only allocated when they are written to, so the parts of a big map
+    nobody visits cost nothing.
+    """
+    if path is None:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="w+", shape=shape)
+
+
+class TiledWorld:
+    """
+    Padded status grid (see GridEnv.status) of a map generated one tile at a
+    time, the first time an agent looks at it.
+    ...
+
+    Cells of the tiles not generated yet are 0, like the walls. Every tile is
+    a generate_blobs of its own, seeded with (seed, tile x, tile y), so a map
+    is the same whatever the order its tiles are visited in. The blobs do not
+    cross the borders of the tiles.
+
+    Attributes
+    ----------
+    status: np.ndarray
+      (grid_size + 2 fov)² uint8, memory mapped when a path is given
+    generated: np.ndarray
+      bool per tile, True once it is generated
+    minerals: int
+      mineral cells in the tiles generated so far
+
+    Methods
+    -------
+    generate_around(positions, radius)
+        Generates the tiles reached by the windows of radius around positions
+    """
+
+    def __init__(
+        self,
+        grid_size: int,
+        fov: int,
+        tile_size: int = 256,
+        fill_ratio: float = 0.1,
+        num_blobs: int = 10,
+        seed=None,
+        path=None,
+    ):
+        self.grid_size = grid_size
+        self.fov = fov
+        self.tile_size = tile_size
+        self.fill_ratio = fill_ratio
+        self.num_blobs = num_blobs
+        # a random map still has to give the same tile when it is generated
+        self.seed = np.random.SeedSequence(seed).entropy
+        size = grid_size + 2 * fov
+        self.status = zeros((size, size), path)
+        tiles = -(-grid_size // tile_size)
+        self.generated = np.zeros((tiles, tiles), dtype=bool)
+        self.minerals = 0
+
+    def generate_around(self, positions: np.ndarray, radius: int) -> int:
+        """
+        Generates the missing tiles under the (2 * radius + 1)² windows
+        centered on (n, 2) positions.
+
+        Returns:
+        - int: mineral cells in the tiles just generated.
+        """
+        positions = np.asarray(positions).reshape(-1, 2)
+        last = self.grid_size - 1
+        low = np.clip(positions - radius, 0, last) // self.tile_size
+        high = np.clip(positions + radius, 0, last) // self.tile_size
+
+        # A window no wider than a tile is on at most 4 of them, its corners'
+        if 2 * radius < self.tile_size:
+            generated = self.generated
+            if np.all(
+                generated[low[:, 0], low[:, 1]]
+                & generated[low[:, 0], high[:, 1]]
+                & generated[high[:, 0], low[:, 1]]
+                & generated[high[:, 0], high[:, 1]]
+            ):
+                return 0
+
+        minerals = 0
+        for (x0, y0), (x1, y1) in zip(low.tolist(), high.tolist()):
+            for tx in range(x0, x1 + 1):
+                for ty in range(y0, y1 + 1):
+                    if not self.generated[tx, ty]:
+                        minerals += self.generate(tx, ty)
+        return minerals
+
+    def generate(self, tx: int, ty: int) -> int:
+        # Delay import to avoid circular dependency
+        from video import generate_blobs
+
+        size, grid_size = self.tile_size, self.grid_size
+        x0, y0 = tx * size, ty * size
+        x1, y1 = min(x0 + size, grid_size), min(y0 + size, grid_size)
+        tile = generate_blobs(
+            x1 - x0,
+            y1 - y0,
+            self.fill_ratio,
+            self.num_blobs,
+            seed=[self.seed, tx, ty],
+        )
+        # The 3x3 mineral corner of GridEnv
+        if x1 > grid_size - 3 and y1 > grid_size - 3:
+            tile[max(grid_size - 3 - x0, 0) :, max(grid_size - 3 - y0, 0) :] = 1
+
+        fov = self.fov
+        self.status[x0 + fov : x1 + fov, y0 + fov : y1 + fov] = np.where(
+            tile == 1, CellStatus.HIDDEN_MINERAL, CellStatus.HIDDEN_EMPTY
+        )
+        self.generated[tx, ty] = True
+        minerals = int(np.count_nonzero(tile))
+        self.minerals += minerals
+        return minerals
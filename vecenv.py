@@ -0,0 +1,259 @@
+import numpy as np
+
+from agent import Agent
+from environment import CellStatus, MOVES
+from video import generate_blobs
+
+
+class VecGridEnv:
+    """
+    num_envs worlds stepped in lockstep, like GridEnv.step_batched on the
+    agents of every world at once, with one Q-table update per step.
+    ...
+
+    The worlds are stacked in the padded layout of GridEnv.status: the flat
+    index of cell (x, y) of world b is (b * size + x + fov) * size + y + fov
+    with size = grid_size + 2 fov, so Agent.observe discovers the cells of
+    all the worlds in one go.
+
+    A world starts over, with a new map and new agents, once it is done:
+    after max_steps steps or when its coverage reaches target_coverage.
+
+    Attributes
+    ----------
+    status: np.ndarray
+      (num_envs, size, size) uint8 CellStatus of every world
+    occupancy: np.ndarray
+      (num_envs, size, size), id + 1 of the agent (within its world)
+      standing on every cell, 0 when it is free
+    positions: np.ndarray
+      (num_envs, num_agent, 2) positions of the agents
+    episode_steps: np.ndarray
+      steps of the current episode of every world
+    cells_explored, veins_found, num_veins: np.ndarray
+      exploration counters of the current episode of every world
+    episodes: list
+      {steps, coverage, vein_recall, reward} of every finished episode
+
+    Methods
+    -------
+    step()
+        Steps every world once, resets the ones that are done
+    reset(b)
+        Starts a new episode in world b
+    train(num_steps, filename)
+        Steps num_steps times, the Q-table is loaded from filename before
+        and saved after
+    """
+
+    def __init__(
+        self,
+        num_envs=8,
+        grid_size=50,
+        num_agent=10,
+        fov=2,
+        learning_rate=0.9,
+        discount_factor=0.99,
+        exploration_rate=0.2,
+        max_steps=1000,
+        target_coverage=None,
+        seed=None,
+        symmetric=False,
+        replay=None,
+    ):
+        self.num_envs = num_envs
+        self.grid_size = grid_size
+        self.num_agent = num_agent
+        self.fov = fov
+        self.max_steps = max_steps
+        self.target_coverage = target_coverage
+        # optional replay.ReplayBuffer, see GridEnv.train
+        self.replay = replay
+        # world i (counting the resets) is generated with seed + i
+        self.seed = seed
+        self.generated = 0
+        self.template_agent = Agent(
+            fov=fov,
+            learning_rate=learning_rate,
+            discount_factor=discount_factor,
+            exploration_rate=exploration_rate,
+            symmetric=symmetric,
+        )
+
+        size = grid_size + 2 * fov
+        self.status = np.zeros((num_envs, size, size), dtype=np.uint8)
+        # status without the walls, as a view
+        self.grid_status = self.status[
+            :, fov : fov + grid_size, fov : fov + grid_size
+        ]
+        self.occupancy = np.zeros(
+            (num_envs, size, size), dtype=np.min_scalar_type(num_agent)
+        )
+        self.positions = np.zeros((num_envs, num_agent, 2), dtype=np.int64)
+        # world of every agent, in the order of positions.reshape(-1, 2)
+        self.worlds = np.repeat(np.arange(num_envs), num_agent)
+        self.state_codes = [0] * (num_envs * num_agent)
+        self.state_symmetries = np.zeros(num_envs * num_agent, dtype=np.intp)
+
+        self.num_cells = grid_size * grid_size
+        self.num_veins = np.zeros(num_envs, dtype=np.int64)
+        self.cells_explored = np.zeros(num_envs, dtype=np.int64)
+        self.veins_found = np.zeros(num_envs, dtype=np.int64)
+        self.agent_rewards = np.zeros((num_envs, num_agent))
+        self.episode_steps = np.zeros(num_envs, dtype=np.int64)
+        self.steps = 0
+        self.episodes = []
+
+        for b in range(num_envs):
+            self.reset(b)
+
+    @property
+    def coverage(self) -> np.ndarray:
+        return self.cells_explored / self.num_cells
+
+    @property
+    def vein_recall(self) -> np.ndarray:
+        return np.divide(
+            self.veins_found,
+            self.num_veins,
+            out=np.ones(self.num_envs),
+            where=self.num_veins > 0,
+        )
+
+    def reset(self, b: int):
+        grid_size, fov, num_agent = self.grid_size, self.fov, self.num_agent
+        seed = None if self.seed is None else self.seed + self.generated
+        self.generated += 1
+
+        # Same world as GridEnv: blobs and a 3x3 mineral corner
+        world = generate_blobs(grid_size, grid_size, 0.1, 10, seed=seed)
+        world[grid_size - 3 :, grid_size - 3 :] = 1
+        self.status[b] = CellStatus.WALL
+        self.grid_status[b] = np.where(
+            world == 1, CellStatus.HIDDEN_MINERAL, CellStatus.HIDDEN_EMPTY
+        )
+        self.num_veins[b] = np.count_nonzero(world)
+
+        cells = {}  # dict as an ordered set
+        while len(cells) < num_agent:
+            cells[int(np.random.randint(grid_size * grid_size))] = None
+        xs, ys = np.divmod(np.array(list(cells), dtype=np.int64), grid_size)
+        self.positions[b] = np.stack([xs, ys], axis=1)
+        self.occupancy[b] = 0
+        self.occupancy[b, xs + fov, ys + fov] = np.arange(1, num_agent + 1)
+
+        agents = slice(b * num_agent, (b + 1) * num_agent)
+        self.state_codes[agents] = [0] * num_agent
+        self.state_symmetries[agents] = 0
+        self.cells_explored[b] = 0
+        self.veins_found[b] = 0
+        self.agent_rewards[b] = 0
+        self.episode_steps[b] = 0
+
+    def count_discoveries(self, looked: np.ndarray, cells: np.ndarray):
+        """
+        GridEnv.count_discoveries, per world
+        """
+        hidden = looked >= CellStatus.HIDDEN_EMPTY
+        worlds = cells[hidden] // self.status[0].size
+        self.cells_explored += np.bincount(worlds, minlength=self.num_envs)
+        minerals = looked[hidden] == CellStatus.HIDDEN_MINERAL
+        self.veins_found += np.bincount(worlds[minerals], minlength=self.num_envs)
+
+    def apply_actions(self, positions: np.ndarray, actions: np.ndarray) -> np.ndarray:
+        """
+        GridEnv.apply_actions for the (num_envs * num_agent, 2) positions of
+        every world
+        """
+        fov = self.fov
+        targets = positions + MOVES[actions]
+        inside = np.all((targets >= 0) & (targets < self.grid_size), axis=1)
+        targets[~inside] = positions[~inside]
+        taken = (
+            self.occupancy[self.worlds, targets[:, 0] + fov, targets[:, 1] + fov] > 0
+        )
+        free = inside & ~taken
+        return np.where(free[:, None], targets, positions)
+
+    def step(self) -> np.ndarray:
+        """
+        Returns:
+        - np.ndarray: bool per world, True for the worlds that were done and
+          have been reset.
+        """
+        agent = self.template_agent
+        fov, grid_size = self.fov, self.grid_size
+        size = self.status.shape[-1]
+        positions = self.positions.reshape(-1, 2)
+
+        actions = agent.choose_actions(self.state_codes, self.state_symmetries)
+        targets = self.apply_actions(positions, actions)
+
+        centers = (self.worlds * size + targets[:, 0] + fov) * size
+        states = agent.observe(self, centers + targets[:, 1] + fov)
+        next_codes, next_symmetries = agent.encode_states(states)
+        rewards = agent.get_rewards(states)
+        self.agent_rewards += rewards.reshape(self.agent_rewards.shape)
+        agent.update_q_tables(
+            self.state_codes,
+            actions,
+            rewards,
+            next_codes,
+            self.state_symmetries,
+            self.replay,
+        )
+        if self.replay is not None:
+            agent.replay(self.replay)
+        agent.trim_q_table(self.replay)
+        self.state_codes = next_codes
+        self.state_symmetries = next_symmetries
+
+        # The first agent of a world to claim a cell gets it, the others
+        # stay in place
+        claims = (self.worlds * grid_size + targets[:, 0]) * grid_size + targets[:, 1]
+        _, first = np.unique(claims, return_index=True)
+        lost = np.ones(len(claims), dtype=bool)
+        lost[first] = False
+        targets[lost] = positions[lost]
+
+        moved = np.flatnonzero(np.any(targets != positions, axis=1))
+        worlds = self.worlds[moved]
+        xs, ys = positions[moved].T
+        self.occupancy[worlds, xs + fov, ys + fov] = 0
+        xs, ys = targets[moved].T
+        self.occupancy[worlds, xs + fov, ys + fov] = moved % self.num_agent + 1
+        positions[moved] = targets[moved]
+
+        self.steps += 1
+        self.episode_steps += 1
+        done = self.episode_steps >= self.max_steps
+        if self.target_coverage is not None:
+            done |= self.coverage >= self.target_coverage
+        for b in np.flatnonzero(done):
+            self.episodes.append(
+                {
+                    "steps": int(self.episode_steps[b]),
+                    "coverage": float(self.coverage[b]),
+                    "vein_recall": float(self.vein_recall[b]),
+                    "reward": float(self.agent_rewards[b].sum()),
+                }
+            )
+            self.reset(b)
+        return done
+
+    def train(self, num_steps=1000, filename="agent.qtb") -> list:
+        """
+        Returns:
+        - list: the episodes finished during training.
+        """
+        finished = len(self.episodes)
+        try:
+            self.template_agent.load_q_table(filename, self.replay)
+        except FileNotFoundError:
+            pass
+
+        for _ in range(num_steps):
+            self.step()
+
+        self.template_agent.save_q_table(filename)
+        return self.episodes[finished:]
@@ -2,7 +2,12 @@
 
 import numpy as np
 import cv2 as cv
-import random
+import multiprocessing
+import queue
+import time
+
+from environment import CellStatus
+from snapshots import Frame
 
 # generation settings
 ROWS = 100
@@ -30,53 +35,71 @@ DISCOVERED_MINERAL = np.array([255, 255, 0])
 JUST_DISCOVERED_MINERAL = np.array([200, 200, 0])
 
 
-def generate_blobs(rows, cols, fill_ratio, num_blobs):
+def generate_blobs(rows, cols, fill_ratio, num_blobs, seed=None):
     """
     Generates a 2D array with multiple random blobs while ensuring a specific fill ratio.
 
+    Every blob is a random walk from a random start, all the walks are drawn at
+    once and bounce off the edges of the grid. The walks are extended until
+    exactly the target number of cells is filled.
+
     Parameters:
     - rows (int): Number of rows in the grid.
     - cols (int): Number of columns in the grid.
     - fill_ratio (float): Target ratio of filled cells (0 to 1).
     - num_blobs (int): Number of distinct blobs.
+    - seed (int): Seed of the generator, the same seed gives the same grid.
 
     Returns:
-    - np.array: A 2D numpy array with 0s (empty) and 1s (filled blobs).
+    - np.array: A 2D uint8 numpy array with 0s (empty) and 1s (filled blobs).
     """
+    rng = np.random.default_rng(seed)
     grid_size = rows * cols
-    target_fill = int(grid_size * fill_ratio)
+    target_fill = int(grid_size * min(max(fill_ratio, 0), 1))
 
     # Initialize grid
-    array = np.zeros((rows, cols), dtype=int)
+    array = np.zeros((rows, cols), dtype=np.uint8)
+    if target_fill == 0:
+        return array
+    filled = array.reshape(-1)
 
     # Select unique random positions for blobs
-    blob_positions = np.array(
-        random.sample([(x, y) for x in range(rows) for y in range(cols)], num_blobs)
-    )
+    num_blobs = min(max(num_blobs, 1), grid_size)
+    starts = rng.choice(grid_size, num_blobs, replace=False)
+    x, y = np.divmod(starts, cols)
 
-    filled_cells = 0
     directions = np.array([(0, 1), (1, 0), (0, -1), (-1, 0)])
-
-    # Function to perform a random walk
-    def random_walk(x, y, steps):
-        nonlocal filled_cells
-        for _ in range(steps):
-            if filled_cells >= target_fill:
-                return
-            if array[x, y] == 0:  # Fill only if empty
-                array[x, y] = 1
-                filled_cells += 1
-
-            # Move randomly while ensuring in-bounds movement
-            dx, dy = directions[random.randint(0, 3)]
-            x, y = np.clip(x + dx, 0, rows - 1), np.clip(y + dy, 0, cols - 1)
-
-    # Perform random walks for each blob
     steps_per_blob = max(1, target_fill // num_blobs)
-    for x, y in blob_positions:
-        random_walk(x, y, steps_per_blob)
-
-    return array
+    filled_cells = 0
+    # Cells to fill, blob after blob in the order they are walked
+    cells = starts
+    while True:
+        cells = cells.reshape(-1)
+        cells = cells[filled[cells] == 0]
+        _, first = np.unique(cells, return_index=True)
+        cells = cells[np.sort(first)][: target_fill - filled_cells]
+        filled[cells] = 1
+        filled_cells += len(cells)
+        if filled_cells >= target_fill:
+            return array
+
+        # Walk every blob steps_per_blob further
+        moves = directions[rng.integers(0, 4, (num_blobs, steps_per_blob))]
+        walk_x = x[:, None] + np.cumsum(moves[..., 0], axis=1)
+        walk_y = y[:, None] + np.cumsum(moves[..., 1], axis=1)
+        x, y = walk_x[:, -1], walk_y[:, -1]
+        cells = _bounce(walk_x, rows) * cols + _bounce(walk_y, cols)
+
+
+def _bounce(walk, size):
+    """
+    Folds an unbounded walk into [0, size), bouncing off the edges
+    """
+    if size == 1:
+        return np.zeros_like(walk)
+    period = 2 * (size - 1)
+    walk = np.mod(walk, period)
+    return np.where(walk < size, walk, period - walk)
 
 
 # def generate_blobs(rows, cols, fill_ratio, num_blobs):
@@ -153,27 +176,98 @@ def generate_blobs(rows, cols, fill_ratio, num_blobs):
 #     return array
 
 
+# Colour of every value painted by draw_environment, out of range values are
+# drawn with ERROR_COLOR
+DRAWING_PALETTE = np.array(
+    [
+        EMPTY_COLOR,
+        MINERAL_COLOR,
+        DISCOVERED_EMPTY,
+        JUST_DISCOVERED_EMPTY,
+        DISCOVERED_MINERAL,
+        JUST_DISCOVERED_MINERAL,
+        ERROR_COLOR,
+        ERROR_COLOR,
+        ERROR_COLOR,
+    ],
+    dtype=np.uint8,
+)
+
+# Colour of every CellStatus, the same as going through draw_environment and
+# grid_to_rgb (discovered cells end up one colour further in DRAWING_PALETTE)
+PALETTE = np.tile(ERROR_COLOR.astype(np.uint8), (16, 1))
+PALETTE[CellStatus.WALL] = EMPTY_COLOR  # tiles of a TiledWorld not generated yet
+PALETTE[CellStatus.HIDDEN_EMPTY] = EMPTY_COLOR
+PALETTE[CellStatus.HIDDEN_MINERAL] = MINERAL_COLOR
+PALETTE[CellStatus.DISCOVERED_EMPTY] = DRAWING_PALETTE[4]
+PALETTE[CellStatus.JUST_DISCOVERED_EMPTY] = DRAWING_PALETTE[5]
+PALETTE[CellStatus.DISCOVERED_MINERAL] = DRAWING_PALETTE[6]
+PALETTE[CellStatus.JUST_DISCOVERED_MINERAL] = DRAWING_PALETTE[7]
+AGENT_COLOR = DRAWING_PALETTE[3]
+# OpenCV wants BGR images
+BGR_PALETTE = np.ascontiguousarray(PALETTE[:, ::-1])
+BGR_AGENT_COLOR = AGENT_COLOR[::-1]
+
+
 def pixel_to_rgb(pixel):
-    match pixel:
-        case 0:
-            return EMPTY_COLOR
-        case 1:
-            return MINERAL_COLOR
-        case 2:
-            return DISCOVERED_EMPTY
-        case 3:
-            return JUST_DISCOVERED_EMPTY
-        case 4:
-            return DISCOVERED_MINERAL
-        case 5:
-            return JUST_DISCOVERED_MINERAL
-        case _:
-            return ERROR_COLOR
+    if 0 <= pixel < len(DRAWING_PALETTE):
+        return DRAWING_PALETTE[pixel]
+    return ERROR_COLOR
 
 
 def grid_to_rgb(grid):
-    return np.array([pixel_to_rgb(pixel) for pixel in grid.flatten()]).reshape(
-        grid.shape[0], grid.shape[1], 3
+    grid = np.asarray(grid)
+    valid = (grid >= 0) & (grid < len(DRAWING_PALETTE))
+    return DRAWING_PALETTE[np.where(valid, grid, len(DRAWING_PALETTE) - 1)]
+
+
+def frame_to_rgb(frame, palette=PALETTE, agent_color=AGENT_COLOR):
+    """
+    Colours a Frame with one lookup in palette, (rows, cols, 3) uint8
+    """
+    image = palette[frame.status]
+    xs, ys = frame.positions.T
+    image[xs, ys] = agent_color
+    return image
+
+
+def crop(frame, roi):
+    """
+    Frame of the cells x0 <= x < x1, y0 <= y < y1 of roi = (x0, y0, x1, y1),
+    with the agents inside it only
+    """
+    x0, y0, x1, y1 = roi
+    offset = np.array([x0, y0])
+    positions = frame.positions
+    inside = np.all((positions >= offset) & (positions < (x1, y1)), axis=1)
+    return Frame(frame.status[x0:x1, y0:y1], positions[inside] - offset)
+
+
+def frame_to_image(frame, scale=None, frame_size=FRAME_SIZE, roi=None):
+    """
+    BGR image of a Frame. By default the same image as
+    array_to_image(grid_to_rgb(draw_environment(world, frame))) without
+    touching the world.
+
+    Parameters:
+    - scale: None to stretch the image to frame_size, an int for that many
+      pixels per cell (1 is the native resolution) or "fit" for the largest
+      int that fits in frame_size.
+    - frame_size ((int, int)): (width, height) for None and "fit".
+    - roi ((int, int, int, int)): Only draws the (x0, y0, x1, y1) cells, see crop.
+    """
+    if roi is not None:
+        frame = crop(frame, roi)
+    image = frame_to_rgb(frame, palette=BGR_PALETTE, agent_color=BGR_AGENT_COLOR)
+    if scale is None:
+        return cv.resize(image, frame_size, interpolation=cv.INTER_NEAREST)
+    if scale == "fit":
+        width, height = frame_size
+        scale = max(1, min(width // image.shape[1], height // image.shape[0]))
+    if scale == 1:
+        return image
+    return cv.resize(
+        image, None, fx=scale, fy=scale, interpolation=cv.INTER_NEAREST
     )
 
 
@@ -184,27 +278,300 @@ def array_to_image(grid):
     return scaled_image
 
 
+class Decimator:
+    """
+    Which of the frames offered to a recorder are kept: every stride-th one,
+    and at most one every interval seconds (of the simulation's wall time)
+    when interval is given.
+    """
+
+    def __init__(self, stride=1, interval=None):
+        self.stride = stride
+        self.interval = interval
+        self.offered = 0
+        self.last = None  # time of the last frame kept
+
+    def keep(self) -> bool:
+        self.offered += 1
+        if (self.offered - 1) % self.stride:
+            return False
+        if self.interval is not None:
+            now = time.perf_counter()
+            if self.last is not None and now - self.last < self.interval:
+                return False
+            self.last = now
+        return True
+
+
+class VideoRecorder:
+    """
+    Writes frames to a video file as soon as they are produced, nothing is
+    kept in memory once a frame is encoded.
+    ...
+
+    The file is opened at the first image, with its size: frame_size with the
+    default scale, else the size of the (cropped) grid times the scale. See
+    frame_to_image for scale and roi, Decimator for stride and interval.
+
+    Attributes
+    ----------
+    frames: int
+      frames encoded
+    skipped: int
+      frames given to record() that were dropped by stride or interval
+
+    Methods
+    -------
+    write(image)
+        Encodes a BGR image, all of them must have the size of the first
+    record(frame)
+        Renders a Frame with frame_to_image and encodes it, if it is kept
+    record_all(frames)
+        Records every Frame of an iterable, a SnapshotLog for instance
+    close()
+        Finishes the file, also done when leaving a with block
+    """
+
+    def __init__(
+        self,
+        filename="output.avi",
+        fps=FRAMES_PER_SECOND,
+        frame_size=FRAME_SIZE,
+        codec=CODEC,
+        scale=None,
+        roi=None,
+        stride=1,
+        interval=None,
+    ):
+        self.filename = filename
+        self.fps = fps
+        self.frame_size = frame_size
+        self.codec = codec
+        self.scale = scale
+        self.roi = roi
+        self.decimator = Decimator(stride, interval)
+        self.frames = 0
+        self.skipped = 0
+        self.video = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, image):
+        if self.video is None:
+            height, width = image.shape[:2]
+            self.video = cv.VideoWriter(
+                self.filename,
+                cv.VideoWriter_fourcc(*self.codec),
+                self.fps,
+                (width, height),
+            )
+        self.video.write(image)
+        self.frames += 1
+
+    def render(self, frame):
+        return frame_to_image(frame, self.scale, self.frame_size, self.roi)
+
+    def record(self, frame):
+        if not self.decimator.keep():
+            self.skipped += 1
+            return
+        self.write(self.render(frame))
+
+    def record_all(self, frames):
+        for frame in frames:
+            self.record(frame)
+
+    def close(self):
+        if self.video is not None:
+            self.video.release()
+
+
+def _encode(frames, video):
+    """
+    Worker of a single process BackgroundRecorder: renders and encodes
+    """
+    with VideoRecorder(**video) as recorder:
+        for _, frame in iter(frames.get, None):
+            recorder.write(recorder.render(frame))
+
+
+def _render(frames, images, video):
+    """
+    Render worker of a BackgroundRecorder, images go to the writer
+    """
+    recorder = VideoRecorder(**video)  # only renders, never opens a file
+    for index, frame in iter(frames.get, None):
+        images.put((index, recorder.render(frame)))
+    images.put(None)
+
+
+def _write(images, renderers, video):
+    """
+    Writer of a BackgroundRecorder, puts the images of the renderers back in
+    order before encoding them
+    """
+    pending = {}
+    following = 0
+    with VideoRecorder(**video) as recorder:
+        while renderers:
+            item = images.get()
+            if item is None:
+                renderers -= 1
+                continue
+            pending[item[0]] = item[1]
+            while following in pending:
+                recorder.write(pending.pop(following))
+                following += 1
+
+
+class BackgroundRecorder:
+    """
+    VideoRecorder whose rendering and encoding run in other processes, so
+    recording costs the simulation little more than copying the frames.
+    ...
+
+    record() copies the frame into a queue of at most queue_size frames and
+    blocks while it is full, the simulation then waits for the video instead
+    of filling the memory. With one worker, it renders and encodes. With
+    more, they render and one more process encodes the images in order.
+
+    scale, roi, stride and interval are the ones of VideoRecorder. The frames
+    are decimated before being copied, and only the roi is copied.
+
+    Attributes
+    ----------
+    frames: int
+      frames recorded
+    skipped: int
+      frames dropped by stride or interval
+    waited: float
+      seconds record() spent waiting for room in the queue
+
+    Methods
+    -------
+    record(frame)
+        Queues a copy of a Frame, if it is kept
+    record_all(frames)
+        Records every Frame of an iterable, a SnapshotLog for instance
+    close()
+        Waits for every frame to be encoded, also done when leaving a with
+        block
+    """
+
+    def __init__(
+        self,
+        filename="output.avi",
+        fps=FRAMES_PER_SECOND,
+        frame_size=FRAME_SIZE,
+        codec=CODEC,
+        workers=1,
+        queue_size=64,
+        scale=None,
+        roi=None,
+        stride=1,
+        interval=None,
+    ):
+        self.filename = filename
+        self.workers = workers
+        self.roi = roi
+        self.decimator = Decimator(stride, interval)
+        self.frames = 0
+        self.skipped = 0
+        self.waited = 0.0
+        self.queue = multiprocessing.Queue(queue_size)
+        # The workers get the frames already cropped
+        video = dict(
+            filename=filename,
+            fps=fps,
+            frame_size=frame_size,
+            codec=codec,
+            scale=scale,
+        )
+        if workers == 1:
+            self.processes = [
+                multiprocessing.Process(target=_encode, args=(self.queue, video))
+            ]
+        else:
+            images = multiprocessing.Queue(queue_size)
+            self.processes = [
+                multiprocessing.Process(
+                    target=_render, args=(self.queue, images, video)
+                )
+                for _ in range(workers)
+            ]
+            self.processes.append(
+                multiprocessing.Process(target=_write, args=(images, workers, video))
+            )
+        for process in self.processes:
+            process.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _put(self, item):
+        start = time.perf_counter()
+        while True:
+            try:
+                self.queue.put(item, timeout=1)
+                break
+            except queue.Full:
+                if not all(process.is_alive() for process in self.processes):
+                    raise RuntimeError(f"a video worker of {self.filename} died")
+        self.waited += time.perf_counter() - start
+
+    def record(self, frame):
+        if not self.decimator.keep():
+            self.skipped += 1
+            return
+        if self.roi is not None:
+            frame = crop(frame, self.roi)
+        # The queue pickles in the background, the frame must not change
+        frame = Frame(np.array(frame.status), np.array(frame.positions))
+        self._put((self.frames, frame))
+        self.frames += 1
+
+    def record_all(self, frames):
+        for frame in frames:
+            self.record(frame)
+
+    def close(self):
+        if not self.processes:
+            return
+        for _ in range(self.workers):
+            self._put(None)
+        for process in self.processes:
+            process.join()
+        self.processes = []
+
+
 def images_to_video(images, filename="output.avi"):
-    codec = cv.VideoWriter_fourcc(*CODEC)
-    video = cv.VideoWriter(filename, codec, FRAMES_PER_SECOND, FRAME_SIZE)
-
-    for image in images:
-        video.write(image)
-
-    video.release()
-
-
-def draw_environment(grid, grid_env_memory):
-    for x, y in grid_env_memory["discovered_empty"]:
-        grid[x][y] = 4  # DISCOVERED_EMPTY
-    for x, y in grid_env_memory["discovered_vein"]:
-        grid[x][y] = 6  # DISCOVERED_MINERAL
-    for x, y in grid_env_memory["just_discovered_empty"]:
-        grid[x][y] = 5  # JUST_DISCOVERED_EMPTY
-    for x, y in grid_env_memory["just_discovered_vein"]:
-        grid[x][y] = 7  # JUST_DISCOVERED_MINERAL
-    for x, y in grid_env_memory["agents"]:
-        grid[x][y] = 3  # AGENT
+    """
+    images can be any iterable, a generator is encoded while it runs
+    """
+    with VideoRecorder(filename) as video:
+        for image in images:
+            video.write(image)
+
+
+def draw_environment(grid, frame):
+    """
+    Copy of grid with the discovered cells and the agents of frame painted on
+    """
+    grid = np.array(grid)
+    status = frame.status
+    grid[status == CellStatus.DISCOVERED_EMPTY] = 4  # DISCOVERED_EMPTY
+    grid[status == CellStatus.DISCOVERED_MINERAL] = 6  # DISCOVERED_MINERAL
+    grid[status == CellStatus.JUST_DISCOVERED_EMPTY] = 5  # JUST_DISCOVERED_EMPTY
+    grid[status == CellStatus.JUST_DISCOVERED_MINERAL] = 7  # JUST_DISCOVERED_MINERAL
+    xs, ys = frame.positions.T
+    grid[xs, ys] = 3  # AGENT
 
     return grid
 